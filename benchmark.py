@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+HEWS - Benchmarks for the Garmin sync.
+
+Runs sync_garmin.main() in daily and historical mode against the in-process
+FakeGarmin with injected latency and records wall time, calls issued, calls
+per second, peak RSS and output write time. Every scenario runs in its own
+subprocess and temporary directory so RSS and on-disk state are isolated.
+
+    python benchmark.py
+    python benchmark.py --scenarios daily,historical-365 --latency-ms 100 \\
+        --env DAY_WORKERS=8 --env ENDPOINT_WORKERS=6 --output before.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent
+HISTORICAL_END = datetime(2025, 12, 31)
+SCENARIOS = {
+    "daily": None,
+    "historical-30": 30,
+    "historical-365": 365,
+    "historical-3650": 3650,
+}
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def run_scenario(name: str) -> dict:
+    """Run one scenario in this process (called in the child)."""
+    days = SCENARIOS[name]
+    if days:
+        os.environ["START_DATE"] = (HISTORICAL_END - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        os.environ["END_DATE"] = HISTORICAL_END.strftime("%Y-%m-%d")
+    else:
+        os.environ.pop("START_DATE", None)
+        os.environ.pop("END_DATE", None)
+
+    sys.path.insert(0, str(REPO_DIR))
+    import sync_garmin
+
+    clients = []
+    write_time = 0.0
+    fake_login = sync_garmin.fake_login
+    save_output = sync_garmin.save_output
+
+    def recording_login(spec):
+        client = fake_login(spec)
+        clients.append(client)
+        return client
+
+    def timed_save(*args, **kwargs):
+        nonlocal write_time
+        started = time.perf_counter()
+        written = save_output(*args, **kwargs)
+        write_time += time.perf_counter() - started
+        return written
+
+    sync_garmin.fake_login = recording_login
+    sync_garmin.save_output = timed_save
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        sync_garmin.main([])
+    wall_time = time.perf_counter() - started
+
+    calls = sum(count for method, count in clients[0].calls.items() if method != "login")
+    output_path = Path("data/health_data.json")
+    return {
+        "scenario": name,
+        "days": days or 2,
+        "wallTimeSec": round(wall_time, 3),
+        "calls": calls,
+        "callsPerSec": round(calls / wall_time, 1) if wall_time else None,
+        "peakRssMb": round(_peak_rss_mb(), 1),
+        "writeTimeSec": round(write_time, 4),
+        "outputBytes": output_path.stat().st_size if output_path.exists() else 0,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sync_garmin.py against a fake Garmin Connect")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for sync_garmin.py, e.g. DAY_WORKERS=8")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        print(json.dumps(run_scenario(args.run_scenario)))
+        return
+
+    env = {
+        **os.environ,
+        "GARMIN_FAKE": "1",
+        "FAKE_LATENCY_MS": str(args.latency_ms),
+        "FAKE_JITTER_MS": str(args.jitter_ms),
+        # Measure the sync itself, not the pacing or a warm cache
+        "GARMIN_RPS": "0",
+        "RESPONSE_CACHE_DIR": "",
+    }
+    env.update(item.split("=", 1) for item in args.env)
+
+    results = []
+    for name in args.scenarios.split(","):
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+        with tempfile.TemporaryDirectory() as workdir:
+            child = subprocess.run([sys.executable, str(Path(__file__).resolve()), "--run-scenario", name],
+                                   cwd=workdir, env=env, capture_output=True, text=True)
+        if child.returncode != 0:
+            print(child.stdout + child.stderr)
+            sys.exit(f"✗ Scenario {name} failed")
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{name:<16} {result['wallTimeSec']:>9.2f}s {result['calls']:>7} calls "
+              f"{result['callsPerSec'] or 0:>8.1f}/s {result['peakRssMb']:>7.1f} MB RSS "
+              f"{result['writeTimeSec']:>8.3f}s write")
+
+    report = {
+        "generatedAt": datetime.now().isoformat(),
+        "commit": _git_commit(),
+        "settings": {"latencyMs": args.latency_ms, "jitterMs": args.jitter_ms,
+                     "env": dict(item.split("=", 1) for item in args.env)},
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"✓ Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
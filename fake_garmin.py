@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+HEWS - Fake Garmin Connect for offline runs and benchmarks.
+
+FakeGarmin is an in-process stand-in for garminconnect.Garmin that serves
+realistic, date-deterministic payloads with configurable latency, jitter,
+errors and 429s. Running this file starts the same fake as a local HTTP
+server, which HttpFakeGarmin talks to.
+
+    GARMIN_FAKE=1 python sync_garmin.py
+    python fake_garmin.py --port 8765 --latency-ms 150 &
+    GARMIN_FAKE=http://127.0.0.1:8765 python sync_garmin.py
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ENDPOINT_METHODS = (
+    "get_stats",
+    "get_hrv_data",
+    "get_stress_data",
+    "get_sleep_data",
+    "get_respiration_data",
+    "get_body_composition",
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+class FakeHTTPError(Exception):
+    """Raised for injected failures; carries a requests-like .response.status_code."""
+
+    def __init__(self, status_code: int, method: str):
+        kind = "Client" if status_code < 500 else "Server"
+        reason = {429: "Too Many Requests", 503: "Service Unavailable"}.get(status_code, "Error")
+        super().__init__(f"{status_code} {kind} Error: {reason} for {method}")
+        self.response = FakeResponse(status_code)
+
+
+class FakeGarth:
+    """Token store stand-in so token reuse can be exercised offline."""
+
+    def dump(self, path: str) -> None:
+        Path(path).mkdir(parents=True, exist_ok=True)
+        (Path(path) / "oauth2_token.json").write_text(json.dumps({"fake": True}), encoding="utf-8")
+
+    def load(self, path: str) -> None:
+        if not (Path(path) / "oauth2_token.json").exists():
+            raise FileNotFoundError(path)
+
+
+def _payload(method: str, date_str: str, seed: int):
+    rng = random.Random(f"{seed}-{method}-{date_str}")
+
+    if method == "get_stats":
+        return {
+            "calendarDate": date_str,
+            "restingHeartRate": rng.randint(48, 64),
+            "totalSteps": rng.randint(1500, 16000),
+            "floorsClimbed": rng.randint(0, 25),
+            "moderateIntensityMinutes": rng.randint(0, 60),
+            "vigorousIntensityMinutes": rng.randint(0, 30),
+            "totalKilocalories": rng.randint(1900, 3200),
+        }
+    if method == "get_hrv_data":
+        if rng.random() < 0.05:
+            return None  # watch not worn overnight
+        weekly = rng.randint(35, 60)
+        return {"hrvSummary": {"calendarDate": date_str, "weeklyAvg": weekly,
+                               "lastNightAvg": weekly + rng.randint(-12, 12), "status": "BALANCED"}}
+    if method == "get_stress_data":
+        return {"calendarDate": date_str, "avgStressLevel": rng.randint(15, 55), "maxStressLevel": rng.randint(60, 99)}
+    if method == "get_sleep_data":
+        deep, light, rem, awake = (rng.randint(2400, 7200), rng.randint(9000, 16000),
+                                   rng.randint(2400, 7200), rng.randint(300, 3000))
+        return {"dailySleepDTO": {
+            "calendarDate": date_str,
+            "sleepTimeSeconds": deep + light + rem,
+            "deepSleepSeconds": deep,
+            "lightSleepSeconds": light,
+            "remSleepSeconds": rem,
+            "awakeSleepSeconds": awake,
+            "awakeCount": rng.randint(0, 4),
+            "sleepScores": {"overall": {"value": rng.randint(40, 95), "qualifierKey": "GOOD"}},
+        }}
+    if method == "get_respiration_data":
+        return {"calendarDate": date_str, "avgWakingRespirationValue": float(rng.randint(12, 18)),
+                "avgSleepRespirationValue": float(rng.randint(11, 16))}
+    raise ValueError(f"unknown endpoint {method}")
+
+
+def _body_composition(start: str, end: str, seed: int) -> dict:
+    day = datetime.strptime(start, "%Y-%m-%d")
+    last = datetime.strptime(end, "%Y-%m-%d")
+    weigh_ins = []
+    while day <= last:
+        date_str = day.strftime("%Y-%m-%d")
+        rng = random.Random(f"{seed}-weight-{date_str}")
+        if rng.random() < 0.3:
+            weigh_ins.append({"calendarDate": date_str, "weight": float(rng.randint(78000, 82000)),
+                              "bmi": round(rng.uniform(23.5, 25.0), 1), "bodyFat": round(rng.uniform(17, 21), 1)})
+        day += timedelta(days=1)
+
+    average = {}
+    for key in ("weight", "bmi", "bodyFat"):
+        values = [entry[key] for entry in weigh_ins]
+        average[key] = sum(values) / len(values) if values else None
+    return {"startDate": start, "endDate": end, "dateWeightList": weigh_ins, "totalAverage": average}
+
+
+class FakeGarmin:
+    """In-process garminconnect.Garmin stand-in.
+
+    latency and jitter are in seconds; error_rate and throttle_rate are the
+    probabilities of a call failing with HTTP 503 and 429. Methods listed in
+    `missing` always return an empty response, like a device without that sensor.
+    """
+
+    def __init__(self, email: str = None, password: str = None, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0, missing=(), seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.missing = set(missing)
+        self.seed = seed
+        self.garth = FakeGarth()
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    @classmethod
+    def from_env(cls) -> "FakeGarmin":
+        return cls(
+            latency=float(os.environ.get("FAKE_LATENCY_MS") or 0) / 1000,
+            jitter=float(os.environ.get("FAKE_JITTER_MS") or 0) / 1000,
+            error_rate=float(os.environ.get("FAKE_ERROR_RATE") or 0),
+            throttle_rate=float(os.environ.get("FAKE_429_RATE") or 0),
+            missing=[m for m in os.environ.get("FAKE_MISSING", "").split(",") if m],
+            seed=int(os.environ.get("FAKE_SEED") or 0),
+        )
+
+    def login(self, tokenstore: str = None) -> None:
+        if tokenstore:
+            self.garth.load(tokenstore)
+        self._respond("login")
+
+    def _respond(self, method: str) -> None:
+        with self._lock:
+            self.calls[method] += 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            roll = self._rng.random()
+        time.sleep(delay)
+        if roll < self.throttle_rate:
+            raise FakeHTTPError(429, method)
+        if roll < self.throttle_rate + self.error_rate:
+            raise FakeHTTPError(503, method)
+
+    def _endpoint(self, method: str, date_str: str):
+        self._respond(method)
+        return None if method in self.missing else _payload(method, date_str, self.seed)
+
+    def get_stats(self, cdate: str):
+        return self._endpoint("get_stats", cdate)
+
+    def get_hrv_data(self, cdate: str):
+        return self._endpoint("get_hrv_data", cdate)
+
+    def get_stress_data(self, cdate: str):
+        return self._endpoint("get_stress_data", cdate)
+
+    def get_sleep_data(self, cdate: str):
+        return self._endpoint("get_sleep_data", cdate)
+
+    def get_respiration_data(self, cdate: str):
+        return self._endpoint("get_respiration_data", cdate)
+
+    def get_body_composition(self, startdate: str, enddate: str = None):
+        self._respond("get_body_composition")
+        if "get_body_composition" in self.missing:
+            return {"startDate": startdate, "endDate": enddate or startdate, "dateWeightList": [], "totalAverage": {}}
+        return _body_composition(startdate, enddate or startdate, self.seed)
+
+
+class HttpFakeGarmin:
+    """garminconnect.Garmin stand-in that calls a fake server started by this module."""
+
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.garth = FakeGarth()
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _get(self, method: str, **params):
+        with self._lock:
+            self.calls[method] += 1
+        query = urllib.parse.urlencode({k: v for k, v in params.items() if v is not None})
+        try:
+            with urllib.request.urlopen(f"{self.base_url}/{method}?{query}", timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise FakeHTTPError(e.code, method) from e
+
+    def login(self, tokenstore: str = None) -> None:
+        if tokenstore:
+            self.garth.load(tokenstore)
+        self._get("login")
+
+    def get_stats(self, cdate: str):
+        return self._get("get_stats", date=cdate)
+
+    def get_hrv_data(self, cdate: str):
+        return self._get("get_hrv_data", date=cdate)
+
+    def get_stress_data(self, cdate: str):
+        return self._get("get_stress_data", date=cdate)
+
+    def get_sleep_data(self, cdate: str):
+        return self._get("get_sleep_data", date=cdate)
+
+    def get_respiration_data(self, cdate: str):
+        return self._get("get_respiration_data", date=cdate)
+
+    def get_body_composition(self, startdate: str, enddate: str = None):
+        return self._get("get_body_composition", date=startdate, end=enddate)
+
+
+def make_handler(fake: FakeGarmin):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            method = url.path.strip("/")
+            params = dict(urllib.parse.parse_qsl(url.query))
+            try:
+                if method == "login":
+                    fake.login()
+                    body = {}
+                elif method == "get_body_composition":
+                    body = fake.get_body_composition(params["date"], params.get("end"))
+                elif method in ENDPOINT_METHODS:
+                    body = getattr(fake, method)(params["date"])
+                else:
+                    self.send_error(404)
+                    return
+            except FakeHTTPError as e:
+                self.send_error(e.response.status_code)
+                return
+            except KeyError:
+                self.send_error(400)
+                return
+
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(fake: FakeGarmin, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    """Start the fake server on a background thread and return it (port 0 = any free port)."""
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Garmin Connect server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    parser.add_argument("--missing", default="", help="comma-separated endpoints that return nothing")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeGarmin(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                      error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                      missing=[m for m in args.missing.split(",") if m], seed=args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    print(f"Fake Garmin Connect listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
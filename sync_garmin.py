@@ -4,27 +4,761 @@ HEWS - Garmin Sync for GitHub Actions
 Fetches health data and saves as JSON for Obsidian plugin.
 """
 
+import argparse
+import asyncio
+import hashlib
 import json
+import math
 import os
+import queue
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from itertools import groupby
 from pathlib import Path
 
 try:
     from garminconnect import Garmin
 except ImportError:
-    print("ERROR: 'garminconnect' not installed!")
-    exit(1)
+    Garmin = None  # only usable with GARMIN_FAKE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # history post-processing falls back to pure Python
 
 
 def get_date_string(date: datetime) -> str:
     return date.strftime("%Y-%m-%d")
 
 
-def fetch_health_data(client: Garmin, target_date: datetime) -> dict:
-    date_str = get_date_string(target_date)
-    print(f"Fetching health data for {date_str}...")
+def env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def env_flag(name: str) -> bool:
+    return os.environ.get(name, "").lower() in ("1", "true", "yes")
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def _fsync_dir(directory: Path) -> None:
+    # Makes the renames durable; not supported on every platform
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class AtomicBatch:
+    """Stage files next to their targets and rename them into place together.
+
+    Every file is written to a temp file in the target directory (fsynced
+    unless fsync=False) and only renamed over its target on commit, in the
+    order it was staged. Readers never see a partial file, and a failure
+    before commit leaves all targets untouched. As a context manager the
+    batch commits on success and discards on error.
+    """
+
+    def __init__(self, fsync: bool = True):
+        self.fsync = fsync
+        self._staged = []
+
+    @contextmanager
+    def open(self, path: Path, binary: bool = False):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            # mkstemp creates 0600; keep the target's mode or use the usual 0644
+            os.chmod(tmp_name, path.stat().st_mode & 0o777 if path.exists() else 0o644)
+            with os.fdopen(fd, "wb") if binary else os.fdopen(fd, "w", encoding="utf-8") as f:
+                yield f
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        self._staged.append((tmp_name, path))
+
+    def write_text(self, path: Path, text: str) -> None:
+        with self.open(path) as f:
+            f.write(text)
+
+    def write_bytes(self, path: Path, data: bytes) -> None:
+        with self.open(path, binary=True) as f:
+            f.write(data)
+
+    def commit(self) -> None:
+        directories = set()
+        for tmp_name, path in self._staged:
+            os.replace(tmp_name, path)
+            directories.add(path.parent)
+        self._staged = []
+        if self.fsync:
+            for directory in directories:
+                _fsync_dir(directory)
+
+    def discard(self) -> None:
+        for tmp_name, _ in self._staged:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+        self._staged = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+
+def atomic_write_text(path: Path, text: str, fsync: bool = True) -> None:
+    with AtomicBatch(fsync) as batch:
+        batch.write_text(path, text)
+
+
+def _exception_chain(exc: Exception):
+    # garminconnect/garth wrap the underlying requests error at different depths
+    seen = set()
+    pending = [exc]
+    while pending:
+        candidate = pending.pop(0)
+        if candidate is None or id(candidate) in seen:
+            continue
+        seen.add(id(candidate))
+        yield candidate
+        pending += [getattr(candidate, "error", None), candidate.__cause__, candidate.__context__]
+
+
+def _http_status(exc: Exception):
+    for candidate in _exception_chain(exc):
+        status = getattr(getattr(candidate, "response", None), "status_code", None)
+        if status:
+            return status
+    # Some wrappers only keep the message, e.g. "503 Server Error: ..."
+    match = re.search(r"\b([1-5]\d\d) (?:Client|Server) Error", str(exc))
+    return int(match.group(1)) if match else None
+
+
+def is_rate_limited(exc: Exception) -> bool:
+    status = _http_status(exc)
+    if status:
+        return status == 429
+    # Without a status only trust the type or a standalone code; messages carry URLs with IDs
+    message = str(exc)
+    return (
+        "TooManyRequests" in type(exc).__name__
+        or "Too Many Requests" in message
+        or re.search(r"(?<![\w/.-])429(?![\w/.-])", message) is not None
+    )
+
+
+# Exception class names (anywhere in the MRO) that mean the request never got an answer
+TRANSIENT_ERRORS = {"Timeout", "TimeoutError", "ConnectTimeout", "ReadTimeout", "ConnectionError"}
+
+
+def is_retryable(exc: Exception) -> bool:
+    """429, 5xx and network failures are worth retrying; other 4xx are not."""
+    status = _http_status(exc)
+    if status:
+        return status in (408, 429) or status >= 500
+    if is_rate_limited(exc):
+        return True
+    return any(cls.__name__ in TRANSIENT_ERRORS
+               for candidate in _exception_chain(exc) for cls in type(candidate).__mro__)
+
+
+def _apply_stats(health_data: dict, stats) -> None:
+    if stats:
+        health_data["rhr"] = stats.get("restingHeartRate")
+        health_data["steps"] = stats.get("totalSteps")
+        health_data["floors"] = stats.get("floorsClimbed")
+        moderate = stats.get("moderateIntensityMinutes") or 0
+        vigorous = stats.get("vigorousIntensityMinutes") or 0
+        health_data["intensityMinutes"] = moderate + (vigorous * 2)
+
+
+def _apply_hrv(health_data: dict, hrv_data) -> None:
+    if hrv_data and "hrvSummary" in hrv_data:
+        health_data["hrv"] = hrv_data["hrvSummary"].get("lastNightAvg") or hrv_data["hrvSummary"].get("weeklyAvg")
+
+
+def _apply_stress(health_data: dict, stress) -> None:
+    if stress and "avgStressLevel" in stress:
+        health_data["stressAvg"] = stress["avgStressLevel"]
+
+
+def _apply_sleep(health_data: dict, sleep) -> None:
+    if sleep and "dailySleepDTO" in sleep:
+        s = sleep["dailySleepDTO"]
+        if s.get("sleepTimeSeconds"):
+            health_data["sleepDuration"] = s["sleepTimeSeconds"] // 60
+        health_data["sleepDeep"] = (s.get("deepSleepSeconds") or 0) // 60
+        health_data["sleepLight"] = (s.get("lightSleepSeconds") or 0) // 60
+        health_data["sleepRem"] = (s.get("remSleepSeconds") or 0) // 60
+        health_data["sleepAwake"] = (s.get("awakeSleepSeconds") or 0) // 60
+        health_data["sleepInterruptions"] = s.get("awakeCount")
+        if "sleepScores" in s:
+            scores = s["sleepScores"]
+            if isinstance(scores, dict):
+                health_data["sleepScore"] = scores.get("overall", {}).get("value") or scores.get("overallScore")
+
+
+def _apply_respiration(health_data: dict, respiration) -> None:
+    if respiration:
+        health_data["respiration"] = respiration.get("avgWakingRespirationValue")
+
+
+def _apply_body(health_data: dict, body) -> None:
+    # The API nests the day's values under totalAverage next to dateWeightList
+    if body and isinstance(body.get("totalAverage"), dict):
+        body = body["totalAverage"]
+    if body and body.get("weight"):
+        health_data["weight"] = round(body["weight"] / 1000, 1)
+        health_data["bmi"] = body.get("bmi")
+        health_data["bodyFat"] = body.get("bodyFat")
+
+
+# (label, client method, parser) - one entry per Garmin call made for a day
+ENDPOINTS = [
+    ("stats", "get_stats", _apply_stats),
+    ("HRV", "get_hrv_data", _apply_hrv),
+    ("stress", "get_stress_data", _apply_stress),
+    ("sleep", "get_sleep_data", _apply_sleep),
+    ("respiration", "get_respiration_data", _apply_respiration),
+    ("body", "get_body_composition", _apply_body),
+]
+
+
+WRAPPED_METHODS = {method for _, method, _ in ENDPOINTS}
+
+# Record fields filled by each endpoint's parser
+ENDPOINT_FIELDS = {
+    "get_stats": ("rhr", "steps", "floors", "intensityMinutes"),
+    "get_hrv_data": ("hrv",),
+    "get_stress_data": ("stressAvg",),
+    "get_sleep_data": ("sleepDuration", "sleepDeep", "sleepLight", "sleepRem", "sleepAwake",
+                       "sleepScore", "sleepInterruptions"),
+    "get_respiration_data": ("respiration",),
+    "get_body_composition": ("weight", "bmi", "bodyFat"),
+}
+
+
+def _split_body_composition(response, dates: list) -> dict:
+    """Turn a range response into single-day responses for each date of the range."""
+    weigh_ins = {}
+    for entry in (response or {}).get("dateWeightList") or []:
+        if entry.get("calendarDate"):
+            weigh_ins.setdefault(entry["calendarDate"], []).append(entry)
     
-    health_data = {
+    by_date = {}
+    for date_str in dates:
+        entries = weigh_ins.get(date_str, [])
+        average = {}
+        for key in ("weight", "bmi", "bodyFat"):
+            values = [entry[key] for entry in entries if entry.get(key) is not None]
+            average[key] = sum(values) / len(values) if values else None
+        by_date[date_str] = {"startDate": date_str, "endDate": date_str,
+                             "dateWeightList": entries, "totalAverage": average}
+    return by_date
+
+
+# Endpoints that accept (start, end) and return the whole range in one response
+RANGE_ENDPOINTS = [
+    ("get_body_composition", _split_body_composition),
+]
+
+
+class ClientWrapper:
+    """Proxy around a Garmin client that intercepts the endpoint methods."""
+
+    def __init__(self, inner):
+        self._inner = inner
+
+    def __getattr__(self, name):
+        attr = getattr(self._inner, name)
+        if name in WRAPPED_METHODS and callable(attr):
+            return lambda *args, **kwargs: self._call(name, *args, **kwargs)
+        return attr
+
+    def _call(self, method: str, *args, **kwargs):
+        return getattr(self._inner, method)(*args, **kwargs)
+
+
+class ConcurrencyLimitedClient(ClientWrapper):
+    """Caps the number of Garmin calls in flight across all threads."""
+
+    def __init__(self, inner, max_concurrency: int):
+        super().__init__(inner)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _call(self, method: str, *args, **kwargs):
+        with self._slots:
+            return super()._call(method, *args, **kwargs)
+
+
+class TokenBucket:
+    """Thread-safe token bucket that halves its rate when Garmin throttles us.
+
+    After a 429 the bucket is drained and paused for `cooldown` seconds; each
+    successful call then recovers 5% of the configured rate.
+    """
+
+    def __init__(self, rate: float, burst: int, cooldown: float = 10.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = rate / 16
+        self.burst = max(1, burst)
+        self.cooldown = cooldown
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._paused_until - now
+            time.sleep(wait)
+
+    def throttled(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return  # already backing off for this burst of 429s
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0.0
+            self._updated = now + self.cooldown
+            self._paused_until = now + self.cooldown
+        print(f"⚠ Rate limited by Garmin - slowing down to {self.rate:.2f} req/s")
+
+    def succeeded(self) -> None:
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class RateLimitedClient(ClientWrapper):
+    """Paces every Garmin call through a shared token bucket."""
+
+    def __init__(self, inner, bucket: TokenBucket):
+        super().__init__(inner)
+        self._bucket = bucket
+
+    def _call(self, method: str, *args, **kwargs):
+        self._bucket.acquire()
+        try:
+            result = super()._call(method, *args, **kwargs)
+        except Exception as e:
+            if is_rate_limited(e):
+                self._bucket.throttled()
+            raise
+        self._bucket.succeeded()
+        return result
+
+
+class RetryingClient(ClientWrapper):
+    """Retries transient failures with exponential backoff and full jitter.
+
+    A call gives up after `attempts` tries, on the first non-retryable error,
+    or when the next wait would exceed `deadline` seconds since the first try.
+    """
+
+    def __init__(self, inner, attempts: int = 3, base_delay: float = 1.0, max_delay: float = 30.0,
+                 deadline: float = 60.0, metrics=None):
+        super().__init__(inner)
+        self._attempts = max(1, attempts)
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._deadline = deadline
+        self._metrics = metrics
+
+    def _call(self, method: str, *args, **kwargs):
+        started = time.monotonic()
+        for attempt in range(1, self._attempts + 1):
+            try:
+                return super()._call(method, *args, **kwargs)
+            except Exception as e:
+                if attempt == self._attempts or not is_retryable(e):
+                    raise
+                delay = random.uniform(0, min(self._max_delay, self._base_delay * 2 ** (attempt - 1)))
+                if time.monotonic() - started + delay > self._deadline:
+                    raise
+                print(f"Retrying {method} {' '.join(map(str, args))} in {delay:.1f}s ({e})")
+                if self._metrics:
+                    self._metrics.count("retries")
+                time.sleep(delay)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreakerClient(ClientWrapper):
+    """Stops calling an endpoint after `threshold` consecutive failures.
+
+    While open, calls fail immediately with CircuitOpenError. After `cooldown`
+    seconds a single probe call is let through (half-open): success closes the
+    circuit, failure re-opens it for another cooldown. 429s are left to the
+    rate limiter and do not count as failures.
+    """
+
+    def __init__(self, inner, threshold: int = 5, cooldown: float = 120.0, metrics=None):
+        super().__init__(inner)
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._metrics = metrics
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def _call(self, method: str, *args, **kwargs):
+        with self._lock:
+            circuit = self._circuits.setdefault(method, {"failures": 0, "openedAt": None, "probing": False})
+            if circuit["openedAt"] is not None:
+                if circuit["probing"] or time.monotonic() - circuit["openedAt"] < self._cooldown:
+                    if self._metrics:
+                        self._metrics.count("circuitOpenSkips")
+                    raise CircuitOpenError(f"circuit open for {method}")
+                circuit["probing"] = True
+        
+        try:
+            result = super()._call(method, *args, **kwargs)
+        except Exception as e:
+            if is_rate_limited(e):
+                with self._lock:
+                    circuit["probing"] = False
+                raise
+            with self._lock:
+                circuit["probing"] = False
+                circuit["failures"] += 1
+                if circuit["openedAt"] is not None or circuit["failures"] >= self._threshold:
+                    if circuit["openedAt"] is None:
+                        print(f"⚡ Circuit opened for {method} after {circuit['failures']} failures")
+                    circuit["openedAt"] = time.monotonic()
+            raise
+        
+        with self._lock:
+            if circuit["openedAt"] is not None:
+                print(f"✓ Circuit closed for {method}")
+            circuit.update(failures=0, openedAt=None, probing=False)
+        return result
+
+
+class CachedClient(ClientWrapper):
+    """Serves endpoint responses from an on-disk cache keyed by (method, date).
+
+    Days at least `final_after_days` old no longer change on Garmin's side, so
+    a response fetched that long after its day is returned without a network
+    call. Anything fetched earlier (e.g. a night without HRV yet) is fetched
+    again and the fresh response replaces the cached copy.
+    """
+
+    def __init__(self, inner, cache_dir: Path, final_after_days: int = 3):
+        super().__init__(inner)
+        self._dir = cache_dir
+        self._final_after_days = final_after_days
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, method: str, date_str: str) -> Path:
+        return self._dir / method / f"{date_str}.json"
+
+    def _is_final(self, date_str: str, fetched_at: str) -> bool:
+        day = datetime.strptime(date_str, "%Y-%m-%d").date()
+        fetched = datetime.fromisoformat(fetched_at).date()
+        return fetched - day >= timedelta(days=self._final_after_days)
+
+    def is_cached_final(self, method: str, date_str: str) -> bool:
+        """True if a call for this day will be answered from the cache."""
+        try:
+            entry = json.loads(self._path(method, date_str).read_text(encoding="utf-8"))
+            return self._is_final(date_str, entry["fetchedAt"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+    def _call(self, method: str, *args, **kwargs):
+        if len(args) != 1 or kwargs:
+            return super()._call(method, *args, **kwargs)
+        
+        date_str = args[0]
+        path = self._path(method, date_str)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+            if self._is_final(date_str, entry["fetchedAt"]):
+                with self._lock:
+                    self.hits += 1
+                return entry["response"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass  # missing or unreadable entry, fetch again
+        
+        response = super()._call(method, date_str)
+        with self._lock:
+            self.misses += 1
+        self._store(path, {"fetchedAt": datetime.now().isoformat(), "response": response})
+        return response
+
+    def _store(self, path: Path, entry: dict) -> None:
+        try:
+            # Cache entries can be refetched, so skip the fsync
+            atomic_write_text(path, json.dumps(entry, ensure_ascii=False), fsync=False)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Could not cache {path}: {e}")
+
+
+def has_values(method: str, response) -> bool:
+    """True if the response fills at least one field of a health record."""
+    apply = next(apply for _, m, apply in ENDPOINTS if m == method)
+    record = empty_record("")
+    blank = dict(record)
+    apply(record, response)
+    return record != blank
+
+
+class EndpointSkipped(Exception):
+    """Raised instead of calling an endpoint the account is known not to fill."""
+
+
+class CapabilityClient(ClientWrapper):
+    """Learns which endpoints never return data for this account and skips them.
+
+    An endpoint with no data for `window` calendar days (counted from its last
+    day with data, or from the first day it was called) is only called on
+    every `probe_every`-th request and raises EndpointSkipped otherwise, so
+    the skip is never cached or mistaken for an empty day. A call with data
+    re-enables it. The profile is persisted between runs.
+    """
+
+    def __init__(self, inner, profile_path: Path, window: int = 14, probe_every: int = 7, metrics=None):
+        super().__init__(inner)
+        self._path = profile_path
+        self._window = window
+        self._probe_every = max(1, probe_every)
+        self._metrics = metrics
+        self._lock = threading.Lock()
+        try:
+            self._profile = json.loads(profile_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self._profile = {}
+
+    def _unsupported(self, entry: dict, date_str: str) -> bool:
+        since = entry.get("lastData") or entry.get("checkedSince")
+        if not since:
+            return False
+        gap = datetime.strptime(date_str, "%Y-%m-%d") - datetime.strptime(since, "%Y-%m-%d")
+        return gap.days >= self._window
+
+    def _call(self, method: str, *args, **kwargs):
+        if len(args) != 1 or kwargs:
+            return super()._call(method, *args, **kwargs)
+        
+        date_str = args[0]
+        with self._lock:
+            entry = self._profile.setdefault(method, {})
+            unsupported = self._unsupported(entry, date_str)
+            if unsupported:
+                # Count requests rather than dates so the probe moves through the weekdays
+                entry["skipsSinceProbe"] = entry.get("skipsSinceProbe", 0) + 1
+                skip = entry["skipsSinceProbe"] < self._probe_every
+                if not skip:
+                    entry["skipsSinceProbe"] = 0
+        if unsupported and skip:
+            if self._metrics:
+                self._metrics.count("capabilitySkips")
+            raise EndpointSkipped(f"{method} skipped, no data since {entry.get('lastData') or 'first call'}")
+        
+        response = super()._call(method, date_str)
+        with self._lock:
+            entry["checkedSince"] = min(entry.get("checkedSince") or date_str, date_str)
+            if has_values(method, response):
+                if unsupported:
+                    print(f"✓ {method} returned data again, no longer skipping it")
+                entry["lastData"] = max(entry.get("lastData") or date_str, date_str)
+                entry.pop("skipsSinceProbe", None)
+        return response
+
+    def save(self) -> None:
+        with self._lock:
+            body = json.dumps(self._profile, indent=2, sort_keys=True)
+        try:
+            atomic_write_text(self._path, body)
+        except OSError as e:
+            print(f"Could not save capability profile {self._path}: {e}")
+
+
+class PrefetchedClient(ClientWrapper):
+    """Answers single-day calls from responses fetched up front via range endpoints."""
+
+    def __init__(self, inner, prefetched: dict):
+        super().__init__(inner)
+        self._prefetched = prefetched
+
+    def _call(self, method: str, *args, **kwargs):
+        if len(args) == 1 and not kwargs and args[0] in self._prefetched.get(method, {}):
+            return self._prefetched[method][args[0]]
+        return super()._call(method, *args, **kwargs)
+
+
+def prefetch_ranges(client: Garmin, start_date: datetime, end_date: datetime, page_days: int = 365,
+                    cached=None) -> dict:
+    """Fetch every range-capable endpoint for START..END in pages of `page_days`.
+
+    Returns {method: {date: single-day response}}. Days of a failed page are
+    left out and fall back to per-day calls. Pages whose days all satisfy
+    `cached(method, date)` (e.g. final in the response cache) are not fetched.
+    """
+    prefetched = {}
+    for method, split in RANGE_ENDPOINTS:
+        by_date = prefetched.setdefault(method, {})
+        page_start = start_date
+        skipped = 0
+        while page_start <= end_date:
+            page_end = min(end_date, page_start + timedelta(days=page_days - 1))
+            dates = [get_date_string(day) for day in date_range(page_start, page_end)]
+            if cached and all(cached(method, date_str) for date_str in dates):
+                skipped += 1
+                page_start = page_end + timedelta(days=1)
+                continue
+            try:
+                response = getattr(client, method)(dates[0], dates[-1])
+                by_date.update(split(response, dates))
+            except Exception as e:
+                print(f"Error {method} {get_date_string(page_start)}..{get_date_string(page_end)}: {e}")
+            page_start = page_end + timedelta(days=1)
+        print(f"✓ Prefetched {method} for {len(by_date)} days"
+              + (f", {skipped} pages already cached" if skipped else ""))
+    return prefetched
+
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Metrics:
+    """Thread-safe per-endpoint latency histograms, outcomes and payload sizes."""
+
+    def __init__(self):
+        self._endpoints = {}
+        self._timings = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, method: str, seconds: float, outcome: str, payload_bytes: int = 0) -> None:
+        latency_ms = seconds * 1000
+        bucket = next((f"<={b}" for b in LATENCY_BUCKETS_MS if latency_ms <= b), f">{LATENCY_BUCKETS_MS[-1]}")
+        with self._lock:
+            stats = self._endpoints.setdefault(method, {
+                "calls": 0, "success": 0, "empty": 0, "error": 0,
+                "latencyMs": {"total": 0.0, "max": 0.0,
+                              "histogram": {**{f"<={b}": 0 for b in LATENCY_BUCKETS_MS},
+                                            f">{LATENCY_BUCKETS_MS[-1]}": 0}},
+                "payloadBytes": 0,
+            })
+            stats["calls"] += 1
+            stats[outcome] += 1
+            stats["latencyMs"]["total"] += latency_ms
+            stats["latencyMs"]["max"] = max(stats["latencyMs"]["max"], latency_ms)
+            stats["latencyMs"]["histogram"][bucket] += 1
+            stats["payloadBytes"] += payload_bytes
+
+    def timing(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self._timings[name] = round(self._timings.get(name, 0.0) + seconds, 3)
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            endpoints = {}
+            for method, stats in sorted(self._endpoints.items()):
+                latency = stats["latencyMs"]
+                endpoints[method] = {
+                    **stats,
+                    "latencyMs": {"mean": round(latency["total"] / stats["calls"], 1),
+                                  "max": round(latency["max"], 1),
+                                  "histogram": dict(latency["histogram"])},
+                }
+            return {"generatedAt": datetime.now().isoformat(), "timingsSec": dict(self._timings),
+                    "counters": dict(self._counters), "endpoints": endpoints}
+
+    def summary(self) -> str:
+        lines = []
+        for method, stats in self.to_dict()["endpoints"].items():
+            lines.append(f"  {method:<22} {stats['calls']:>5} calls  {stats['error']:>4} errors  "
+                         f"{stats['empty']:>4} empty  {stats['latencyMs']['mean']:>7.1f} ms avg")
+        return "\n".join(lines)
+
+
+class InstrumentedClient(ClientWrapper):
+    """Records latency, outcome and payload size of every Garmin call."""
+
+    def __init__(self, inner, metrics: Metrics):
+        super().__init__(inner)
+        self._metrics = metrics
+
+    def _call(self, method: str, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = super()._call(method, *args, **kwargs)
+        except Exception:
+            self._metrics.record(method, time.perf_counter() - started, "error")
+            raise
+        elapsed = time.perf_counter() - started
+        if response:
+            self._metrics.record(method, elapsed, "success", len(json.dumps(response, default=str)))
+        else:
+            self._metrics.record(method, elapsed, "empty")
+        return response
+
+
+# Numeric per-day fields, in the column order of the columnar export
+METRIC_FIELDS = (
+    "hrv", "rhr", "stressAvg", "respiration",
+    "sleepDuration", "sleepDeep", "sleepLight", "sleepRem", "sleepAwake", "sleepScore",
+    "sleepInterruptions", "steps", "floors", "intensityMinutes",
+    "weight", "bmi", "bodyFat",
+)
+
+
+def empty_record(date_str: str) -> dict:
+    return {
         "date": date_str,
         "source": "garmin",
         "fetchedAt": datetime.now().isoformat(),
@@ -35,102 +769,1163 @@ def fetch_health_data(client: Garmin, target_date: datetime) -> dict:
         "steps": None, "floors": None, "intensityMinutes": None,
         "weight": None, "bmi": None, "bodyFat": None
     }
+
+
+def _call_endpoint(client: Garmin, method: str, date_str: str):
+    return getattr(client, method)(date_str)
+
+
+def _apply_responses(health_data: dict, responses: list) -> None:
+    # One response (or the exception it raised) per ENDPOINTS entry
+    failed = []
+    skipped = []
+    for (label, method, apply), response in zip(ENDPOINTS, responses):
+        try:
+            if isinstance(response, Exception):
+                raise response
+            apply(health_data, response)
+        except EndpointSkipped:
+            skipped.append(method)
+        except Exception as e:
+            print(f"Error {label}: {e}")
+            failed.append(method)
+    # Lets a later merge keep earlier values instead of these gaps
+    if failed:
+        health_data["failedEndpoints"] = failed
+    if skipped:
+        health_data["skippedEndpoints"] = skipped
+
+
+def merge_record(old: dict, new: dict) -> dict:
+    """new, with the fields of endpoints that failed or were skipped in new taken from old where new has none."""
+    missing = (new.get("failedEndpoints") or []) + (new.get("skippedEndpoints") or [])
+    if not old or not missing:
+        return new
+    merged = dict(new)
+    for method in missing:
+        for field in ENDPOINT_FIELDS.get(method, ()):
+            if merged.get(field) is None and old.get(field) is not None:
+                merged[field] = old[field]
+    return merged
+
+
+def fetch_health_data(client: Garmin, target_date: datetime, workers: int = 1) -> dict:
+    date_str = get_date_string(target_date)
+    print(f"Fetching health data for {date_str}...")
     
-    # Stats Summary
-    try:
-        stats = client.get_stats(date_str)
-        if stats:
-            health_data["rhr"] = stats.get("restingHeartRate")
-            health_data["steps"] = stats.get("totalSteps")
-            health_data["floors"] = stats.get("floorsClimbed")
-            moderate = stats.get("moderateIntensityMinutes") or 0
-            vigorous = stats.get("vigorousIntensityMinutes") or 0
-            health_data["intensityMinutes"] = moderate + (vigorous * 2)
-    except Exception as e:
-        print(f"Error stats: {e}")
+    health_data = empty_record(date_str)
+    
+    # Issue the calls (concurrently if workers > 1), then parse in a fixed
+    # order so the resulting dict is identical to a sequential fetch
+    responses = []
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(ENDPOINTS))) as pool:
+            futures = [pool.submit(_call_endpoint, client, method, date_str) for _, method, _ in ENDPOINTS]
+        responses = [future.exception() or future.result() for future in futures]
+    else:
+        for _, method, _ in ENDPOINTS:
+            try:
+                responses.append(_call_endpoint(client, method, date_str))
+            except Exception as e:
+                responses.append(e)
     
-    # HRV
+    _apply_responses(health_data, responses)
+    return health_data
+
+
+async def fetch_health_data_async(client: Garmin, target_date: datetime,
+                                  call_slots: asyncio.Semaphore, executor: ThreadPoolExecutor) -> dict:
+    """fetch_health_data for the event loop; the blocking client runs on `executor`."""
+    date_str = get_date_string(target_date)
+    print(f"Fetching health data for {date_str}...")
+    
+    health_data = empty_record(date_str)
+    loop = asyncio.get_running_loop()
+    
+    async def call(method: str):
+        async with call_slots:
+            return await loop.run_in_executor(executor, _call_endpoint, client, method, date_str)
+    
+    responses = await asyncio.gather(*(call(method) for _, method, _ in ENDPOINTS), return_exceptions=True)
+    _apply_responses(health_data, responses)
+    return health_data
+
+
+async def sync_days_async(client: Garmin, dates: list, day_workers: int, call_concurrency: int,
+                          on_complete, deadline: float = None) -> None:
+    """Drive all days and all endpoint calls through one event loop.
+
+    At most `day_workers` days and `call_concurrency` Garmin calls are in flight;
+    only the calls themselves occupy threads.
+    """
+    day_slots = asyncio.Semaphore(max(1, day_workers))
+    call_slots = asyncio.Semaphore(call_concurrency)
+    
+    with ThreadPoolExecutor(max_workers=call_concurrency) as executor:
+        async def fetch_day(day: datetime):
+            async with day_slots:
+                if deadline and time.monotonic() > deadline:
+                    return None
+                return await fetch_health_data_async(client, day, call_slots, executor)
+        
+        for task in asyncio.as_completed([fetch_day(day) for day in dates]):
+            record = await task
+            if record is not None:
+                on_complete(record)
+
+
+def login(email: str, password: str, token_store: str) -> Garmin:
+    # Reuse OAuth tokens from a previous run; garth refreshes the short-lived
+    # OAuth2 token on its own, so credentials are only needed when that fails
+    if token_store and Path(token_store).expanduser().exists():
+        try:
+            client = Garmin(email, password)
+            client.login(str(Path(token_store).expanduser()))
+            print("✓ Login successful (stored tokens)")
+            return client
+        except Exception as e:
+            print(f"Stored tokens rejected, logging in with credentials: {e}")
+    
+    client = Garmin(email, password)
+    client.login()
+    print("✓ Login successful")
+    save_tokens(client, token_store)
+    return client
+
+
+def fake_login(spec: str):
+    # GARMIN_FAKE=1 serves data in-process, GARMIN_FAKE=http://... uses fake_garmin.py's server
+    from fake_garmin import FakeGarmin, HttpFakeGarmin
+    
+    client = HttpFakeGarmin(spec) if spec.startswith("http") else FakeGarmin.from_env()
+    client.login()
+    print("✓ Login successful (fake Garmin Connect)")
+    return client
+
+
+def save_tokens(client: Garmin, token_store: str) -> None:
+    if not token_store:
+        return
+    # garminconnect < 0.3 keeps the OAuth session in .garth, 0.3+ in its own .client
+    session = getattr(client, "garth", None) or getattr(client, "client", None)
     try:
-        hrv_data = client.get_hrv_data(date_str)
-        if hrv_data and "hrvSummary" in hrv_data:
-            health_data["hrv"] = hrv_data["hrvSummary"].get("lastNightAvg") or hrv_data["hrvSummary"].get("weeklyAvg")
+        session.dump(str(Path(token_store).expanduser()))
     except Exception as e:
-        print(f"Error HRV: {e}")
+        print(f"Could not save tokens to {token_store}: {e}")
+
+
+def _report_progress(done: int, total: int, started: float) -> None:
+    elapsed = time.monotonic() - started
+    rate = done / elapsed if elapsed > 0 else 0.0
+    eta = (total - done) / rate if rate > 0 else 0.0
+    print(f"  ⏳ {done}/{total} days ({done * 100 // total}%) - {rate:.1f} days/s, ETA {eta:.0f}s")
+
+
+class Checkpoint:
+    """Append-only NDJSON log of completed days, used to resume historical imports."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        records = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line of a killed run
+                    records[record["date"]] = record
+        except FileNotFoundError:
+            pass
+        return records
+
+    def append(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "a+", encoding="utf-8")
+                # Terminate a torn line so the next record stays parseable
+                if self._file.tell() > 0:
+                    self._file.seek(self._file.tell() - 1)
+                    if self._file.read(1) != "\n":
+                        self._file.write("\n")
+            self._file.write(line)
+            self._file.flush()
+
+    def index(self) -> dict:
+        """Return {date: byte offset} of the latest line for each day, without keeping records."""
+        offsets = {}
+        try:
+            with open(self.path, "rb") as f:
+                offset = 0
+                for line in f:
+                    try:
+                        offsets[json.loads(line)["date"]] = offset
+                    except (ValueError, KeyError):
+                        pass
+                    offset += len(line)
+        except FileNotFoundError:
+            pass
+        return offsets
+
+    def records(self, offsets: dict) -> "LoggedRecords":
+        return LoggedRecords(self.path, offsets)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self) -> None:
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+def _iter_days_threaded(client: Garmin, dates: list, day_workers: int, endpoint_workers: int,
+                        deadline: float = None):
+    with ThreadPoolExecutor(max_workers=max(1, day_workers)) as pool:
+        futures = [pool.submit(fetch_health_data, client, day, endpoint_workers) for day in dates]
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            yield future.result()
+            if deadline and time.monotonic() > deadline:
+                for pending in futures:
+                    pending.cancel()
+
+
+def _iter_days_async(client: Garmin, dates: list, day_workers: int, call_concurrency: int,
+                     deadline: float = None):
+    # Run the event loop on its own thread and hand finished days back through a queue
+    finished = queue.Queue()
+    errors = []
+    
+    def run():
+        try:
+            asyncio.run(sync_days_async(client, dates, day_workers, call_concurrency, finished.put, deadline))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            finished.put(None)
     
-    # Stress
+    threading.Thread(target=run, daemon=True).start()
+    while (record := finished.get()) is not None:
+        yield record
+    if errors:
+        raise errors[0]
+
+
+def iter_days(client: Garmin, dates: list, day_workers: int = 1, endpoint_workers: int = 1,
+              deadline: float = None, async_calls: int = 0):
+    """Fetch the given days in parallel, yielding each record as soon as it is done.
+
+    With `async_calls` > 0 the days run on an asyncio event loop with that many
+    Garmin calls in flight instead of nested thread pools. Once `deadline` (a
+    time.monotonic() value) passes, days that have not started yet are skipped.
+    """
+    total = len(dates)
+    if total == 0:
+        return
+    progress_every = env_int("PROGRESS_EVERY", max(1, total // 20))
+    started = time.monotonic()
+    
+    if async_calls > 0:
+        records = _iter_days_async(client, dates, day_workers, async_calls, deadline)
+    else:
+        records = _iter_days_threaded(client, dates, day_workers, endpoint_workers, deadline)
+    
+    for done, record in enumerate(records, 1):
+        yield record
+        if done % progress_every == 0 or done == total:
+            _report_progress(done, total, started)
+
+
+class LoggedRecords:
+    """Re-iterable view of selected days of an NDJSON log, read from disk on demand."""
+
+    def __init__(self, path: Path, offsets: dict):
+        self._path = path
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __iter__(self):
+        if not self._offsets:
+            return  # the log may not exist yet
+        with open(self._path, "rb") as f:
+            for offset in self._offsets.values():
+                f.seek(offset)
+                yield json.loads(f.readline())
+
+
+def fetch_days(client: Garmin, dates: list, day_workers: int = 1, endpoint_workers: int = 1,
+               on_complete=None, deadline: float = None, async_calls: int = 0) -> list:
+    """Like iter_days, but returns the records in the order of `dates`."""
+    position = {get_date_string(day): i for i, day in enumerate(dates)}
+    records = [None] * len(dates)
+    
+    # Days complete in any order; slot them back by index so the result stays sorted
+    for record in iter_days(client, dates, day_workers, endpoint_workers, deadline, async_calls):
+        records[position[record["date"]]] = record
+        if on_complete:
+            on_complete(record)
+    
+    return [record for record in records if record is not None]
+
+
+def date_range(start_date: datetime, end_date: datetime) -> list:
+    dates = []
+    current_date = start_date
+    while current_date <= end_date:
+        dates.append(current_date)
+        current_date += timedelta(days=1)
+    return dates
+
+
+def is_settled(record: dict, final_after_days: int) -> bool:
+    """True for a logged day that no resume needs to fetch again.
+
+    Days with failed endpoints, and days fetched before they were
+    `final_after_days` old (still provisional then), are not settled.
+    """
+    if record.get("failedEndpoints") or not record.get("fetchedAt"):
+        return False
+    day = datetime.strptime(record["date"], "%Y-%m-%d").date()
+    return datetime.fromisoformat(record["fetchedAt"]).date() - day >= timedelta(days=final_after_days)
+
+
+def fetch_history(client: Garmin, start_date: datetime, end_date: datetime,
+                  day_workers: int = 1, endpoint_workers: int = 1,
+                  checkpoint: Checkpoint = None, deadline: float = None, async_calls: int = 0,
+                  final_after_days: int = 3) -> list:
+    """Fetch START..END, skipping days already settled in the checkpoint.
+
+    The result is shorter than the range if the deadline stopped the run early.
+    """
+    records = checkpoint.load() if checkpoint else {}
+    done = {day for day, record in records.items() if is_settled(record, final_after_days)}
+    if done:
+        print(f"↻ Resuming from checkpoint: {len(done)} days already fetched")
+    
+    pending = [day for day in date_range(start_date, end_date) if get_date_string(day) not in done]
+    on_complete = None
+    if checkpoint:
+        on_complete = lambda record: checkpoint.append(merge_record(records.get(record["date"]), record))
+    for record in fetch_days(client, pending, day_workers, endpoint_workers, on_complete, deadline, async_calls):
+        records[record["date"]] = merge_record(records.get(record["date"]), record)
+    if checkpoint:
+        checkpoint.close()
+    
+    return [records[day] for day in sorted(records)]
+
+
+def stream_history(client: Garmin, start_date: datetime, end_date: datetime, log: Checkpoint,
+                   day_workers: int = 1, endpoint_workers: int = 1, deadline: float = None,
+                   async_calls: int = 0, final_after_days: int = 3) -> dict:
+    """Append START..END to an NDJSON log as days finish, without keeping them in memory.
+
+    Days already settled in the log are skipped; the others are fetched again
+    and appended, the latest line of a day wins. Returns {date: offset} for the
+    days of the range present in the log, in date order.
+    """
+    dates = [get_date_string(day) for day in date_range(start_date, end_date)]
+    logged = log.index()
+    in_range = log.records({day: logged[day] for day in dates if day in logged})
+    # Only the few unsettled days are kept, to merge their re-fetch with
+    unsettled = {record["date"]: record for record in in_range if not is_settled(record, final_after_days)}
+    pending = [datetime.strptime(day, "%Y-%m-%d") for day in dates if day not in logged or day in unsettled]
+    if len(pending) < len(dates):
+        print(f"↻ Resuming from {log.path}: {len(dates) - len(pending)} days already fetched")
+    
+    for record in iter_days(client, pending, day_workers, endpoint_workers, deadline, async_calls):
+        log.append(merge_record(unsettled.get(record["date"]), record))
+    log.close()
+    
+    logged = log.index()
+    return {day: logged[day] for day in dates if day in logged}
+
+
+# A day whose record still lacks one of these is re-fetched by incremental syncs
+PROVISIONAL_FIELDS = ("hrv", "sleepScore")
+
+
+def load_records(output_path: Path) -> dict:
+    """Return {date: record} for every day in a previously written output file."""
     try:
-        stress = client.get_stress_data(date_str)
-        if stress and "avgStressLevel" in stress:
-            health_data["stressAvg"] = stress["avgStressLevel"]
-    except Exception as e:
-        print(f"Error stress: {e}")
+        previous = json.loads(output_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
     
-    # Sleep
+    records = {}
+    for record in [*(previous.get("history") or []), previous.get("yesterday"), previous.get("today")]:
+        if record and record.get("date"):
+            records[record["date"]] = record
+    return records
+
+
+class MergedHistory:
+    """Re-iterable, date-sorted view of earlier records with a fetched START..END merged in.
+
+    The fetched range is re-read on every pass, so an NDJSON-backed range stays on disk.
+    """
+
+    def __init__(self, previous: dict, fetched, start: str, end: str):
+        self._previous = previous
+        self._fetched = fetched
+        self._start = start
+        self._end = end
+        self._before = sorted(day for day in previous if day < start)
+        self._after = sorted(day for day in previous if day > end)
+
+    def __len__(self) -> int:
+        return len(self._before) + len(self._fetched) + len(self._after)
+
+    def __iter__(self):
+        for day in self._before:
+            yield self._previous[day]
+        for record in self._fetched:
+            yield merge_record(self._previous.get(record["date"]), record)
+        for day in self._after:
+            yield self._previous[day]
+
+    def get(self, day: str):
+        if not self._start <= day <= self._end:
+            return self._previous.get(day)
+        for record in self._fetched:
+            if record["date"] == day:
+                return merge_record(self._previous.get(day), record)
+        return None
+
+
+def stale_dates(records: dict, today: datetime, window_days: int) -> list:
+    """Dates in the window ending today that are missing, still provisional or partly failed."""
+    due = []
+    for offset in range(window_days - 1, -1, -1):
+        day = today - timedelta(days=offset)
+        record = records.get(get_date_string(day))
+        # today and yesterday keep changing until the next night's sync
+        if (record is None or offset <= 1 or record.get("failedEndpoints")
+                or any(record.get(f) is None for f in PROVISIONAL_FIELDS)):
+            due.append(day)
+    return due
+
+
+# Keys that describe the run rather than a health value; the mode only says how
+# the file was produced, so e.g. an --export of unchanged data leaves it alone
+VOLATILE_KEYS = ("lastSync", "fetchedAt", "generatedAt", "contentHash", "mode")
+
+
+def _without_volatile(value):
+    if isinstance(value, dict):
+        return {k: _without_volatile(v) for k, v in value.items() if k not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [_without_volatile(v) for v in value]
+    return value
+
+
+def content_hash(output: dict) -> str:
+    """SHA-256 over the health values of an output, ignoring timestamps.
+
+    "history" may be any re-iterable and is hashed one record at a time.
+    """
+    digest = hashlib.sha256()
+    for key in sorted(output):
+        if key in VOLATILE_KEYS:
+            continue
+        values = output[key] if key == "history" else [output[key]]
+        digest.update(f"{json.dumps(key)}\n".encode("utf-8"))
+        for value in values:
+            digest.update(json.dumps(_without_volatile(value), sort_keys=True, ensure_ascii=False).encode("utf-8"))
+            digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def _stored_hash(output_path: Path):
+    # contentHash is the first key of a written file, so the head is enough
     try:
-        sleep = client.get_sleep_data(date_str)
-        if sleep and "dailySleepDTO" in sleep:
-            s = sleep["dailySleepDTO"]
-            if s.get("sleepTimeSeconds"):
-                health_data["sleepDuration"] = s["sleepTimeSeconds"] // 60
-            health_data["sleepDeep"] = (s.get("deepSleepSeconds") or 0) // 60
-            health_data["sleepLight"] = (s.get("lightSleepSeconds") or 0) // 60
-            health_data["sleepRem"] = (s.get("remSleepSeconds") or 0) // 60
-            health_data["sleepAwake"] = (s.get("awakeSleepSeconds") or 0) // 60
-            health_data["sleepInterruptions"] = s.get("awakeCount")
-            if "sleepScores" in s:
-                scores = s["sleepScores"]
-                if isinstance(scores, dict):
-                    health_data["sleepScore"] = scores.get("overall", {}).get("value") or scores.get("overallScore")
-    except Exception as e:
-        print(f"Error sleep: {e}")
+        with open(output_path, encoding="utf-8") as f:
+            head = f.read(256)
+    except OSError:
+        return None
+    match = re.search(r'"contentHash": "([0-9a-f]{64})"', head)
+    return match.group(1) if match else None
+
+
+def save_output(output_path: Path, output: dict, batch: AtomicBatch = None) -> bool:
+    """Write output as key-sorted JSON (indent=2), streaming "history" from any iterable.
+
+    The file is left untouched when the content hash of its health values is
+    unchanged, so an unchanged day produces no commit. Returns True if written.
+    With a batch the file is only staged and replaced when the batch commits.
+    """
+    digest = content_hash(output)
+    if _stored_hash(output_path) == digest:
+        print(f"✓ No health values changed, {output_path} left untouched")
+        return False
+    
+    output = {**output, "contentHash": digest}
     
-    # Respiration
+    own_batch = batch is None
+    batch = batch or AtomicBatch()
+    with batch.open(output_path) as f:
+        f.write("{")
+        for i, key in enumerate(sorted(output)):
+            value = output[key]
+            f.write("," if i else "")
+            f.write(f"\n  {json.dumps(key)}: ")
+            if key != "history":
+                f.write(json.dumps(value, indent=2, sort_keys=True, ensure_ascii=False).replace("\n", "\n  "))
+                continue
+            f.write("[")
+            count = 0
+            for record in value:
+                f.write(",\n    " if count else "\n    ")
+                f.write(json.dumps(record, indent=2, sort_keys=True, ensure_ascii=False).replace("\n", "\n    "))
+                count += 1
+            f.write("\n  ]" if count else "]")
+        f.write("\n}\n")
+    if own_batch:
+        batch.commit()
+    return True
+
+
+def write_shards(shard_dir: Path, records, batch: AtomicBatch = None) -> None:
+    """Merge date-sorted records into per-month shards and refresh the manifest.
+
+    A shard is only rewritten when the hash of its health values changes; the
+    manifest keeps the day each shard last changed so clients can skip
+    unchanged months, and is itself only rewritten when a shard changed.
+    Shards and manifest are swapped in together, the manifest last.
+    """
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = shard_dir / "manifest.json"
     try:
-        respiration = client.get_respiration_data(date_str)
-        if respiration:
-            health_data["respiration"] = respiration.get("avgWakingRespirationValue")
-    except Exception as e:
-        print(f"Error respiration: {e}")
+        previous = json.loads(manifest_path.read_text(encoding="utf-8"))
+        shards = {entry["month"]: entry for entry in previous.get("shards", [])}
+    except (OSError, ValueError):
+        shards = {}
+    
+    own_batch = batch is None
+    batch = batch or AtomicBatch()
+    today = get_date_string(datetime.now())
+    written = 0
+    for month, month_records in groupby(records, key=lambda record: record["date"][:7]):
+        path = shard_dir / f"{month}.json"
+        try:
+            days = {day["date"]: day for day in json.loads(path.read_text(encoding="utf-8"))["days"]}
+        except (OSError, ValueError, KeyError):
+            days = {}
+        days.update((record["date"], record) for record in month_records)
+        
+        shard = {"month": month, "days": [days[d] for d in sorted(days)]}
+        digest = content_hash(shard)
+        if shards.get(month, {}).get("hash") == digest and path.exists():
+            continue
+        batch.write_text(path, json.dumps(shard, indent=2, sort_keys=True, ensure_ascii=False) + "\n")
+        shards[month] = {"month": month, "file": path.name, "hash": digest, "days": len(days), "lastModified": today}
+        written += 1
+    
+    if written or not manifest_path.exists():
+        manifest = {"generatedAt": datetime.now().isoformat(), "shards": [shards[m] for m in sorted(shards)]}
+        batch.write_text(manifest_path, json.dumps(manifest, indent=2, sort_keys=True, ensure_ascii=False) + "\n")
+    if own_batch:
+        batch.commit()
+    print(f"✓ History shards: {written} of {len(shards)} months updated")
+
+
+class StoredRecords:
+    """Re-iterable view of a date range of a HealthStore, queried on demand."""
+
+    def __init__(self, store: "HealthStore", start: str = None, end: str = None):
+        self._store = store
+        self._start = start or "0000-00-00"
+        self._end = end or "9999-99-99"
+
+    def __len__(self) -> int:
+        return self._store.count(self._start, self._end)
+
+    def __iter__(self):
+        # Keyset pages keep memory flat without holding the connection across yields
+        after = ""
+        while True:
+            rows = self._store.query("SELECT date, record FROM days WHERE date BETWEEN ? AND ? AND date > ? "
+                                     "ORDER BY date LIMIT 500", (self._start, self._end, after))
+            for after, record in rows:
+                yield json.loads(record)
+            if len(rows) < 500:
+                return
+
+
+class HealthStore:
+    """SQLite store of daily records keyed by date.
+
+    One row per day with the record as JSON. Days and ranges are primary-key
+    lookups, and a sync only upserts the days it fetched instead of
+    rewriting the whole history.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS days (date TEXT PRIMARY KEY, record TEXT NOT NULL) WITHOUT ROWID")
+        self._db.commit()
+
+    def upsert(self, records) -> int:
+        """Insert or replace days; fields of failed or skipped endpoints keep their stored values."""
+        rows = []
+        for record in records:
+            if not record or not record.get("date"):
+                continue
+            if record.get("failedEndpoints") or record.get("skippedEndpoints"):
+                record = merge_record(self.get(record["date"]), record)
+            rows.append((record["date"], json.dumps(record, sort_keys=True, ensure_ascii=False)))
+        with self._lock, self._db:
+            self._db.executemany("INSERT INTO days (date, record) VALUES (?, ?) "
+                                 "ON CONFLICT(date) DO UPDATE SET record = excluded.record", rows)
+        return len(rows)
+
+    def query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def get(self, date_str: str):
+        rows = self.query("SELECT record FROM days WHERE date = ?", (date_str,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def count(self, start: str = "0000-00-00", end: str = "9999-99-99") -> int:
+        return self.query("SELECT COUNT(*) FROM days WHERE date BETWEEN ? AND ?", (start, end))[0][0]
+
+    def range(self, start: str = None, end: str = None) -> StoredRecords:
+        return StoredRecords(self, start, end)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def export_store(store: HealthStore, output_path: Path, mode: str = "export", batch: AtomicBatch = None,
+                 baselines: bool = False) -> bool:
+    """Regenerate health_data.json from the store, streaming the history from it."""
+    today = datetime.now()
+    output = {
+        "lastSync": datetime.now().isoformat(),
+        "mode": mode,
+        "today": store.get(get_date_string(today)),
+        "yesterday": store.get(get_date_string(today - timedelta(days=1))),
+        "history": store.range(),
+    }
+    if baselines:
+        output = with_baselines(output)
+    return save_output(output_path, output, batch)
+
+
+# Fields and window lengths (days) of the rolling baselines
+BASELINE_FIELDS = ("hrv", "rhr", "stressAvg", "sleepDuration", "steps")
+BASELINE_WINDOWS = (7, 28, 90)
+
+
+class RollingWindow:
+    """Mean, median and standard deviation over the last `days` calendar days.
+
+    Days are pushed in date order; running sums and a sorted copy of the
+    window are updated as values enter and leave, so each day costs
+    O(log n) instead of a rescan of the window.
+    """
+
+    def __init__(self, days: int):
+        self.days = days
+        self._values = deque()
+        self._sorted = []
+        self._sum = 0.0
+        self._sum_sq = 0.0
+
+    def push(self, ordinal: int, value) -> None:
+        while self._values and self._values[0][0] <= ordinal - self.days:
+            _, old = self._values.popleft()
+            self._sum -= old
+            self._sum_sq -= old * old
+            del self._sorted[bisect_left(self._sorted, old)]
+        if value is not None:
+            self._values.append((ordinal, value))
+            self._sum += value
+            self._sum_sq += value * value
+            insort(self._sorted, value)
+
+    def summary(self) -> dict:
+        n = len(self._sorted)
+        if not n:
+            return {"mean": None, "median": None, "std": None}
+        mean = self._sum / n
+        mid = n // 2
+        median = self._sorted[mid] if n % 2 else (self._sorted[mid - 1] + self._sorted[mid]) / 2
+        std = math.sqrt(max(0.0, (self._sum_sq - n * mean * mean) / (n - 1))) if n > 1 else None
+        return {"mean": round(mean, 1), "median": median, "std": round(std, 2) if std is not None else None}
+
+
+class BaselinedRecords:
+    """Re-iterable view of date-sorted records with a "baselines" key added to each day.
+
+    baselines[field]["7d"] holds mean, median and std of that field over the
+    7 calendar days ending with the record's date (same for 28d and 90d);
+    missing values are skipped.
+    """
+
+    def __init__(self, records):
+        self._records = records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self):
+        windows = {(field, days): RollingWindow(days) for field in BASELINE_FIELDS for days in BASELINE_WINDOWS}
+        for record in self._records:
+            ordinal = datetime.strptime(record["date"], "%Y-%m-%d").toordinal()
+            baselines = {}
+            for field in BASELINE_FIELDS:
+                baselines[field] = {}
+                for days in BASELINE_WINDOWS:
+                    window = windows[field, days]
+                    window.push(ordinal, record.get(field))
+                    baselines[field][f"{days}d"] = window.summary()
+            yield {**record, "baselines": baselines}
+
+
+def with_baselines(output: dict, store: "HealthStore" = None) -> dict:
+    """Return output with rolling baselines on every day of history, today and yesterday.
+
+    Without a history (daily mode) the preceding days come from the store if
+    there is one, otherwise only today and yesterday count.
+    """
+    days = [day for day in (output["yesterday"], output["today"]) if day]
+    history = output["history"]
+    if history:
+        source = history
+    elif store and days:
+        start = datetime.strptime(days[0]["date"], "%Y-%m-%d") - timedelta(days=max(BASELINE_WINDOWS))
+        source = store.range(get_date_string(start))
+    else:
+        source = days
+    
+    wanted = {day["date"] for day in days}
+    current = {record["date"]: record for record in BaselinedRecords(source) if record["date"] in wanted}
+    return {
+        **output,
+        "today": current.get(output["today"]["date"], output["today"]) if output["today"] else None,
+        "yesterday": current.get(output["yesterday"]["date"], output["yesterday"]) if output["yesterday"] else None,
+        "history": BaselinedRecords(history) if history else history,
+    }
+
+
+ROLLUP_PERIODS = ("week", "month", "year")
+
+
+def rollup_buckets(date_str: str) -> dict:
+    """{"week": "2026-W03", "month": "2026-01", "year": "2026"} for a date (ISO weeks)."""
+    iso_year, iso_week, _ = datetime.strptime(date_str, "%Y-%m-%d").isocalendar()
+    return {"week": f"{iso_year}-W{iso_week:02d}", "month": date_str[:7], "year": date_str[:4]}
+
+
+def _bucket_start(period: str, key: str) -> str:
+    if period == "week":
+        return get_date_string(datetime.strptime(f"{key}-1", "%G-W%V-%u"))
+    return f"{key}-01" if period == "month" else f"{key}-01-01"
+
+
+def _bucket_end(period: str, key: str) -> str:
+    start = datetime.strptime(_bucket_start(period, key), "%Y-%m-%d")
+    if period == "week":
+        return get_date_string(start + timedelta(days=6))
+    if period == "month":
+        return get_date_string((start + timedelta(days=31)).replace(day=1) - timedelta(days=1))
+    return f"{key}-12-31"
+
+
+def _percentile(values: list, q: float):
+    # Linear interpolation between closest ranks of sorted values
+    position = (len(values) - 1) * q
+    low = math.floor(position)
+    high = min(low + 1, len(values) - 1)
+    return round(values[low] + (values[high] - values[low]) * (position - low), 1)
+
+
+# Rollups sum these fields, average the means and add percentiles of sleepDuration
+ROLLUP_SUMS = ("steps", "floors", "intensityMinutes")
+ROLLUP_MEANS = ("hrv", "rhr", "stressAvg", "sleepScore")
+SLEEP_PERCENTILES = (("P25", 0.25), ("Median", 0.5), ("P75", 0.75))
 
-    # Body Composition
+
+def _rollup(records: list) -> dict:
+    rollup = {"days": len(records)}
+    for field in ROLLUP_SUMS:
+        values = [r[field] for r in records if r.get(field) is not None]
+        rollup[f"{field}Sum"] = sum(values) if values else None
+    for field in ROLLUP_MEANS:
+        values = [r[field] for r in records if r.get(field) is not None]
+        rollup[f"{field}Mean"] = round(sum(values) / len(values), 1) if values else None
+    sleep = sorted(r["sleepDuration"] for r in records if r.get("sleepDuration") is not None)
+    rollup["sleepDurationSum"] = sum(sleep) if sleep else None
+    rollup["sleepDurationMean"] = round(sum(sleep) / len(sleep), 1) if sleep else None
+    for name, q in SLEEP_PERCENTILES:
+        rollup[f"sleepDuration{name}"] = _percentile(sleep, q) if sleep else None
+    return rollup
+
+
+def _run_percentiles(values, present, starts) -> dict:
+    # Sort every run at once (NaN last), then interpolate like _percentile
+    runs = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(values))))
+    ordered = values[np.lexsort((values, runs))]
+    counts = np.add.reduceat(present.astype(np.int64), starts)
+    percentiles = {}
+    for name, q in SLEEP_PERCENTILES:
+        position = (counts - 1) * q
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, counts - 1)
+        a, b = ordered[starts + np.maximum(low, 0)], ordered[starts + np.maximum(high, 0)]
+        percentiles[name] = [round(value, 1) if count else None
+                             for value, count in zip((a + (b - a) * (position - low)).tolist(), counts.tolist())]
+    return percentiles
+
+
+def _rollups_numpy(records: list) -> dict:
+    # Same aggregates as _rollup, with all buckets of a period reduced at once
+    dates = [r["date"] for r in records]
+    days = np.array(dates, dtype="datetime64[D]")
+    day_numbers = days.astype(np.int64)
+    codes = {
+        "week": day_numbers - (day_numbers + 3) % 7,  # Monday of the week; 1970-01-01 was a Thursday
+        "month": days.astype("datetime64[M]").astype(np.int64),
+        "year": days.astype("datetime64[Y]").astype(np.int64),
+    }
+    fields = (*ROLLUP_SUMS, *ROLLUP_MEANS, "sleepDuration")
+    values = {field: float_column([r.get(field) for r in records]) for field in fields}
+    present = {field: ~np.isnan(column) for field, column in values.items()}
+    # sum() of ints stays an int in _rollup, so sums are only floats where a float went in
+    summed = (*ROLLUP_SUMS, "sleepDuration")
+    floats = {field: np.array([isinstance(r.get(field), float) for r in records]) for field in summed}
+    
+    result = {}
+    for period in ROLLUP_PERIODS:
+        # Records are date-sorted, so every bucket is one contiguous run
+        starts = np.flatnonzero(np.diff(codes[period], prepend=codes[period][0] - 1))
+        sizes = np.diff(np.append(starts, len(dates))).tolist()
+        totals = {field: np.add.reduceat(np.where(present[field], values[field], 0.0), starts).tolist()
+                  for field in fields}
+        counts = {field: np.add.reduceat(present[field].astype(np.int64), starts).tolist() for field in fields}
+        any_float = {field: np.logical_or.reduceat(floats[field], starts).tolist() for field in summed}
+        percentiles = _run_percentiles(values["sleepDuration"], present["sleepDuration"], starts)
+        
+        for i, start in enumerate(starts.tolist()):
+            rollup = {"days": sizes[i]}
+            sums = {field: (totals[field][i] if any_float[field][i] else int(totals[field][i]))
+                    if counts[field][i] else None for field in summed}
+            for field in ROLLUP_SUMS:
+                rollup[f"{field}Sum"] = sums[field]
+            for field in ROLLUP_MEANS:
+                rollup[f"{field}Mean"] = round(totals[field][i] / counts[field][i], 1) if counts[field][i] else None
+            count = counts["sleepDuration"][i]
+            rollup["sleepDurationSum"] = sums["sleepDuration"]
+            rollup["sleepDurationMean"] = round(totals["sleepDuration"][i] / count, 1) if count else None
+            for name, _ in SLEEP_PERCENTILES:
+                rollup[f"sleepDuration{name}"] = percentiles[name][i]
+            result[period, rollup_buckets(dates[start])[period]] = rollup
+    return result
+
+
+def compute_rollups(records: list) -> dict:
+    """{(period, key): rollup} for every bucket touched by date-sorted records.
+
+    Runs vectorized on NaN-filled NumPy arrays when NumPy is installed and
+    per bucket in pure Python otherwise; both give the same values.
+    """
+    if np is not None and records:
+        return _rollups_numpy(records)
+    groups = {}
+    for record in records:
+        for period, key in rollup_buckets(record["date"]).items():
+            groups.setdefault((period, key), []).append(record)
+    return {bucket: _rollup(days) for bucket, days in groups.items()}
+
+
+def update_rollups(path: Path, records, changed: list = None, batch: AtomicBatch = None,
+                   within: tuple = None) -> None:
+    """Refresh the ISO week, month and year rollups in path for the buckets holding changed dates.
+
+    records are date-sorted, either as an iterable or as a callable that takes
+    the first date needed (e.g. HealthStore.range) so only the affected
+    buckets are read. All buckets are rebuilt when changed is None or the file
+    is missing. within=(first, last) limits the update to buckets lying
+    entirely inside that range, for records that may lack days outside it;
+    the other buckets keep their stored rollup. The file is left untouched
+    when no bucket changed.
+    """
     try:
-        body = client.get_body_composition(date_str)
-        if body and body.get("weight"):
-            health_data["weight"] = round(body["weight"] / 1000, 1)
-            health_data["bmi"] = body.get("bmi")
-            health_data["bodyFat"] = body.get("bodyFat")
-    except Exception as e:
-        print(f"Error body: {e}")
+        previous = json.loads(path.read_text(encoding="utf-8"))
+        rollups = {period: dict(previous.get(period) or {}) for period in ROLLUP_PERIODS}
+    except (OSError, ValueError):
+        previous, changed = None, None
+        rollups = {period: {} for period in ROLLUP_PERIODS}
     
-    return health_data
+    def inside(period, key):
+        return not within or within[0] <= _bucket_start(period, key) and _bucket_end(period, key) <= within[1]
+    
+    partial = set()
+    if changed is None:
+        affected, start = None, within[0] if within else None
+        rollups = {period: {key: rollup for key, rollup in rollups[period].items() if not inside(period, key)}
+                   for period in ROLLUP_PERIODS}
+    else:
+        affected = {(period, key) for day in changed for period, key in rollup_buckets(day).items()}
+        partial = {bucket for bucket in affected if not inside(*bucket)}
+        affected -= partial
+        if not affected:
+            if partial:
+                print(f"⚠ Rollups: {len(partial)} buckets reach beyond the fetched range, left unchanged")
+            return
+        start = min(_bucket_start(period, key) for period, key in affected)
+    
+    selected = []
+    for record in records(start) if callable(records) else records:
+        if start and record["date"] < start:
+            continue
+        if affected is None or any(bucket in affected for bucket in rollup_buckets(record["date"]).items()):
+            selected.append(record)
+    
+    computed = compute_rollups(selected)
+    if affected is None:
+        partial = {bucket for bucket in computed if not inside(*bucket)}
+    if partial:
+        print(f"⚠ Rollups: {len(partial)} buckets reach beyond the fetched range, left unchanged")
+    before = {period: (previous or {}).get(period) or {} for period in ROLLUP_PERIODS}
+    updated = 0
+    for period, key in affected if affected is not None else computed.keys() - partial:
+        rollup = computed.get((period, key))
+        if rollup:
+            rollups[period][key] = rollup
+        else:
+            rollups[period].pop(key, None)
+        updated += before[period].get(key) != rollup
+    
+    if previous is not None and all(rollups[period] == before[period] for period in ROLLUP_PERIODS):
+        print("✓ Rollups: no bucket changed")
+        return
+    output = {"generatedAt": datetime.now().isoformat(),
+              **{period: dict(sorted(rollups[period].items())) for period in ROLLUP_PERIODS}}
+    text = json.dumps(output, indent=2, ensure_ascii=False) + "\n"
+    if batch:
+        batch.write_text(path, text)
+    else:
+        atomic_write_text(path, text)
+    print(f"✓ Rollups: {updated} buckets updated")
 
 
-def main():
-    # Get credentials from environment variables
-    email = os.environ.get("GARMIN_EMAIL")
-    password = os.environ.get("GARMIN_PASSWORD")
+def columnar(records) -> dict:
+    """Turn date-sorted records into {"dates": [...], field: [...]} with one array per metric."""
+    columns = {"dates": [], **{field: [] for field in METRIC_FIELDS}}
+    for record in records:
+        columns["dates"].append(record["date"])
+        for field in METRIC_FIELDS:
+            columns[field].append(record.get(field))
+    return columns
+
+
+def float_column(values: list):
+    """values as float64 with NaN for None: a NumPy array if installed, else array("d")."""
+    if np is not None:
+        return np.array(values, dtype=np.float64)
+    return array("d", (math.nan if value is None else value for value in values))
+
+
+def _float64_le(values: list) -> bytes:
+    column = float_column(values)
+    if np is not None:
+        return column.astype("<f8").tobytes()
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+def _columns_binary(columns: dict) -> bytes:
+    # uint32 header length, JSON header padded to 8 bytes, then one float64 column after another
+    names = ["date", *METRIC_FIELDS]
+    header = json.dumps({"count": len(columns["dates"]), "columns": names, "dtype": "float64",
+                         "byteOrder": "little", "date": "days since 1970-01-01"}).encode("utf-8")
+    header += b" " * (-(4 + len(header)) % 8)
+    epoch = datetime(1970, 1, 1).toordinal()
+    days = [datetime.strptime(d, "%Y-%m-%d").toordinal() - epoch for d in columns["dates"]]
+    data = b"".join(_float64_le(column) for column in [days, *(columns[field] for field in METRIC_FIELDS)])
+    return len(header).to_bytes(4, "little") + header + data
+
+
+def write_columnar(path: Path, records, binary: bool = False, batch: AtomicBatch = None) -> None:
+    """Write the history column-wise as compact JSON, optionally also as a float64 file (.bin).
+
+    Missing values are null in the JSON and NaN in the binary file. Files
+    whose bytes would not change are left untouched.
+    """
+    columns = columnar(records)
+    files = {path: (json.dumps(columns, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8")}
+    if binary:
+        files[path.with_suffix(".bin")] = _columns_binary(columns)
     
-    if not email or not password:
-        print("ERROR: GARMIN_EMAIL and GARMIN_PASSWORD environment variables required")
-        exit(1)
+    own_batch = batch is None
+    batch = batch or AtomicBatch()
+    written = 0
+    for target, data in files.items():
+        try:
+            if target.read_bytes() == data:
+                continue
+        except OSError:
+            pass
+        batch.write_bytes(target, data)
+        written += 1
+    if own_batch:
+        batch.commit()
+    print(f"✓ Columnar export: {len(columns['dates'])} days, {written} of {len(files)} files updated")
+
+
+def write_metrics(metrics_path: Path, metrics: Metrics) -> None:
+    if not metrics_path:
+        return
+    atomic_write_text(Path(metrics_path), json.dumps(metrics.to_dict(), indent=2))
+
+
+class SyncError(Exception):
+    pass
+
+
+def data_path(name: str, data_dir: Path, default: str, isolated: bool = False, enabled: bool = True):
+    """Resolve a path setting: unset means data_dir/default, empty disables it.
+
+    Isolated (multi-account) syncs always keep their files under their own
+    data_dir, so a configured path only acts as an on/off switch there.
+    """
+    value = os.environ.get(name)
+    if value == "" or (value is None and not enabled):
+        return None
+    if value is None or isolated:
+        return data_dir / default
+    return Path(value)
+
+
+def sync_account(name: str, email: str, password: str, data_dir: Path, token_store: str,
+                 requests_per_second: float, burst: int, isolated: bool = False,
+                 shared_bucket: TokenBucket = None) -> dict:
+    """Sync one Garmin account into data_dir and return a summary of the run."""
+    # Offline stand-in for Garmin Connect (see fake_garmin.py)
+    fake = os.environ.get("GARMIN_FAKE", "")
     
     # Check for date range parameters (historical mode)
     start_date_str = os.environ.get("START_DATE")
     end_date_str = os.environ.get("END_DATE")
     
-    print("=" * 50)
-    print("HEWS Garmin Sync (GitHub Actions)")
-    print("=" * 50)
+    # Parallel Garmin calls per day / parallel days in historical mode (1 = sequential)
+    endpoint_workers = env_int("ENDPOINT_WORKERS", 1)
+    day_workers = env_int("DAY_WORKERS", 1)
+    # Upper bound on Garmin calls in flight across all threads (0 = no limit)
+    max_concurrency = env_int("MAX_CONCURRENCY", 0)
+    # Drive days and calls through one asyncio event loop instead of nested thread pools
+    async_calls = 0
+    if env_flag("ASYNC_SYNC"):
+        async_calls = max_concurrency or day_workers * endpoint_workers
+    # Local response cache; days older than the horizon are never re-fetched
+    cache_dir = data_path("RESPONSE_CACHE_DIR", data_dir, "cache", isolated)
+    final_after_days = env_int("CACHE_FINAL_AFTER_DAYS", 3)
+    # Rolling window of days kept complete by the daily sync (0 = only today + yesterday)
+    incremental_days = env_int("INCREMENTAL_DAYS", 0)
+    # Historical imports log finished days here and resume from it
+    checkpoint_dir = data_path("CHECKPOINT_DIR", data_dir, "checkpoints", isolated)
+    # Stop a historical import cleanly after this many minutes (0 = no limit)
+    time_budget = env_float("TIME_BUDGET_MINUTES", 0)
+    # Historical mode: append days to an NDJSON log and stream the output from it
+    stream = env_flag("STREAM_HISTORY")
+    history_log = data_path("HISTORY_NDJSON", data_dir, "health_history.ndjson", isolated)
+    # Retries of transient failures (429, 5xx, timeouts) per Garmin call
+    retry_attempts = env_int("RETRY_ATTEMPTS", 3)
+    # Consecutive failures before an endpoint is skipped for a cooldown (0 = never)
+    breaker_threshold = env_int("BREAKER_THRESHOLD", 5)
+    # Endpoints without data for this many days are only sampled afterwards (0 = always call)
+    capability_window = env_int("CAPABILITY_WINDOW", 0)
+    capability_profile = data_path("CAPABILITY_PROFILE", data_dir, "cache/capabilities.json", isolated)
+    # Historical mode: days per range call for range-capable endpoints (0 = per-day calls)
+    range_page_days = env_int("RANGE_PAGE_DAYS", 365)
+    # Per-month history files plus manifest for clients (disabled unless set)
+    shard_dir = data_path("HISTORY_SHARD_DIR", data_dir, "history", isolated, enabled=False)
+    # Column-per-metric copy of the history for charts (disabled unless set)
+    columnar_path = data_path("COLUMNAR_PATH", data_dir, "health_columns.json", isolated, enabled=False)
+    # Weekly/monthly/yearly aggregates, refreshed only for buckets with fetched days (disabled unless set)
+    rollups_path = data_path("ROLLUPS_PATH", data_dir, "rollups.json", isolated, enabled=False)
+    # Add rolling 7/28/90-day baselines to every day of the output
+    baselines = env_flag("BASELINES")
+    # SQLite store of all days; health_data.json is then exported from it (disabled unless set)
+    store_path = data_path("HEALTH_DB", data_dir, "health.db", isolated, enabled=False)
+    
+    output_path = data_dir / "health_data.json"
+    # Per-endpoint latency/outcome metrics written at the end of the run (empty = disabled)
+    metrics_path = data_path("METRICS_PATH", data_dir, "sync_metrics.json", isolated)
+    metrics = Metrics()
     
     # Login to Garmin
-    print("\nLogging in to Garmin Connect...")
+    print(f"\nLogging in to Garmin Connect{f' ({name})' if isolated else ''}...")
+    started = time.perf_counter()
     try:
-        client = Garmin(email, password)
-        client.login()
-        print("✓ Login successful")
+        if fake:
+            garmin = fake_login(fake)
+            token_store = ""
+        else:
+            garmin = login(email, password, token_store)
     except Exception as e:
-        print(f"✗ Login failed: {e}")
-        exit(1)
+        raise SyncError(f"Login failed: {e}") from e
+    metrics.timing("login", time.perf_counter() - started)
+    
+    started = time.perf_counter()
+    client = InstrumentedClient(garmin, metrics)
+    if max_concurrency > 0:
+        client = ConcurrencyLimitedClient(client, max_concurrency)
+    if shared_bucket:
+        client = RateLimitedClient(client, shared_bucket)
+    if requests_per_second > 0:
+        bucket = TokenBucket(requests_per_second, burst, env_float("RATE_LIMIT_COOLDOWN", 10.0))
+        client = RateLimitedClient(client, bucket)
+    if retry_attempts > 1:
+        client = RetryingClient(client, retry_attempts, env_float("RETRY_BASE_DELAY", 1.0),
+                                env_float("RETRY_MAX_DELAY", 30.0), env_float("CALL_DEADLINE", 60.0), metrics)
+    if breaker_threshold > 0:
+        client = CircuitBreakerClient(client, breaker_threshold, env_float("BREAKER_COOLDOWN", 120.0), metrics)
+    capabilities = None
+    if capability_window > 0 and capability_profile:
+        capabilities = CapabilityClient(client, capability_profile, capability_window,
+                                        env_int("CAPABILITY_PROBE_DAYS", 7), metrics)
+        client = capabilities
+    prefetched = None
+    if start_date_str and end_date_str and range_page_days > 0:
+        prefetched = {}
+        client = PrefetchedClient(client, prefetched)
+    if cache_dir:
+        client = CachedClient(client, cache_dir, final_after_days)
+    if prefetched is not None:
+        # One paged call per range-capable metric instead of one per day, except
+        # for pages the cache already answers day by day
+        prefetched.update(prefetch_ranges(client, datetime.strptime(start_date_str, "%Y-%m-%d"),
+                                          datetime.strptime(end_date_str, "%Y-%m-%d"), range_page_days,
+                                          client.is_cached_final if cache_dir else None))
+    
+    checkpoint = None
+    store = None
+    rollup_within = None
+    if store_path:
+        store = HealthStore(store_path)
+        if not store.count():
+            # Seed a new database from the existing output
+            store.upsert(load_records(output_path).values())
     
     # Determine mode
     if start_date_str and end_date_str:
@@ -140,13 +1935,40 @@ def main():
         
         print(f"\n📅 Historical mode: {start_date_str} to {end_date_str}")
         
-        history = []
-        current_date = start_date
+        deadline = time.monotonic() + time_budget * 60 if time_budget > 0 else None
+        total_days = (end_date - start_date).days + 1
+        changed = [get_date_string(day) for day in date_range(start_date, end_date)]
+        # Without a store, days outside the range may be missing from the history
+        rollup_within = None if store else (start_date_str, end_date_str)
+        
+        if stream and history_log:
+            # The log is the durable history (and checkpoint); it is never held in memory
+            log = Checkpoint(history_log)
+            offsets = stream_history(client, start_date, end_date, log, day_workers, endpoint_workers,
+                                     deadline, async_calls, final_after_days)
+            history = log.records(offsets)
+            fetched = len(offsets)
+        else:
+            if checkpoint_dir:
+                checkpoint = Checkpoint(checkpoint_dir / f"historical_{start_date_str}_{end_date_str}.ndjson")
+            history = fetch_history(client, start_date, end_date, day_workers, endpoint_workers,
+                                    checkpoint, deadline, async_calls, final_after_days)
+            fetched = len(history)
         
-        while current_date <= end_date:
-            data = fetch_health_data(client, current_date)
-            history.append(data)
-            current_date += timedelta(days=1)
+        if store:
+            store.upsert(history)
+        
+        if fetched < total_days:
+            print(f"\n⏸ Time budget used up after {fetched} of {total_days} days")
+            print("  Run again with the same START_DATE/END_DATE to resume from the checkpoint")
+            save_tokens(garmin, token_store)
+            if capabilities:
+                capabilities.save()
+            metrics.timing("fetch", time.perf_counter() - started)
+            write_metrics(metrics_path, metrics)
+            if store:
+                store.close()
+            return _summary(name, "paused", fetched, metrics)
         
         output = {
             "lastSync": datetime.now().isoformat(),
@@ -157,37 +1979,279 @@ def main():
             "yesterday": None,
             "history": history
         }
+        if store:
+            # The store holds more than this range; export all of it like the other modes
+            today = datetime.now()
+            output.update(today=store.get(get_date_string(today)),
+                          yesterday=store.get(get_date_string(today - timedelta(days=1))),
+                          history=store.range())
+        else:
+            # Keep the days outside the range (and today) from the previous output
+            history = MergedHistory(load_records(output_path), history, start_date_str, end_date_str)
+            today = datetime.now()
+            output.update(today=history.get(get_date_string(today)),
+                          yesterday=history.get(get_date_string(today - timedelta(days=1))),
+                          history=history)
+        
+        print(f"\n✓ Fetched {fetched} days of data")
+        
+    elif incremental_days > 0:
+        # Incremental mode: heal gaps and provisional days, keep existing history
+        print(f"\n📅 Incremental mode: last {incremental_days} days")
+        
+        today = datetime.now()
+        if store:
+            # Only the window is read; older days stay in the database
+            window_start = get_date_string(today - timedelta(days=incremental_days - 1))
+            records = {record["date"]: record for record in store.range(window_start)}
+        else:
+            records = load_records(output_path)
+        due = stale_dates(records, today, incremental_days)
+        print(f"{len(due)} of {incremental_days} days missing or provisional")
         
-        print(f"\n✓ Fetched {len(history)} days of data")
+        fetched_records = fetch_days(client, due, day_workers, endpoint_workers, async_calls=async_calls)
+        for record in fetched_records:
+            # A failed endpoint must not erase what an earlier run got
+            records[record["date"]] = merge_record(records.get(record["date"]), record)
+        fetched = len(due)
+        changed = [get_date_string(day) for day in due]
+        if store:
+            store.upsert(fetched_records)
+        
+        output = {
+            "lastSync": datetime.now().isoformat(),
+            "mode": "incremental",
+            "today": records.get(get_date_string(today)),
+            "yesterday": records.get(get_date_string(today - timedelta(days=1))),
+            "history": store.range() if store else [records[day] for day in sorted(records)]
+        }
         
     else:
         # Normal daily mode
         print("\n📅 Normal mode: today + yesterday")
         
         today = datetime.now()
-        today_data = fetch_health_data(client, today)
+        today_data = fetch_health_data(client, today, endpoint_workers)
         
         yesterday = today - timedelta(days=1)
-        yesterday_data = fetch_health_data(client, yesterday)
+        yesterday_data = fetch_health_data(client, yesterday, endpoint_workers)
+        fetched = 2
+        changed = [get_date_string(yesterday), get_date_string(today)]
+        if store:
+            store.upsert([yesterday_data, today_data])
         
         output = {
             "lastSync": datetime.now().isoformat(),
             "mode": "daily",
             "today": today_data,
             "yesterday": yesterday_data,
-            "history": []
+            "history": store.range() if store else []
         }
     
+    metrics.timing("fetch", time.perf_counter() - started)
+    
     # Save to JSON file
-    output_path = Path("data/health_data.json")
-    output_path.parent.mkdir(exist_ok=True)
+    started = time.perf_counter()
+    if baselines:
+        output = with_baselines(output, store)
+    
+    # Shards and health_data.json are swapped in together, health_data.json last
+    with AtomicBatch() as batch:
+        records = output["history"] or [day for day in (output["yesterday"], output["today"]) if day]
+        if shard_dir:
+            write_shards(shard_dir, records, batch)
+        if columnar_path:
+            write_columnar(columnar_path, store.range() if store else records, env_flag("COLUMNAR_BINARY"), batch)
+        if rollups_path:
+            if store or output["history"]:
+                update_rollups(rollups_path, store.range if store else output["history"], changed, batch,
+                               rollup_within)
+            else:
+                print("⚠ Rollups skipped: daily mode has no history without HEALTH_DB")
+        written = save_output(output_path, output, batch)
+    metrics.timing("save", time.perf_counter() - started)
     
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(output, f, indent=2, ensure_ascii=False)
+    if checkpoint:
+        checkpoint.remove()
+    if store:
+        store.close()
+    
+    if isinstance(client, CachedClient):
+        print(f"✓ Response cache: {client.hits} hits, {client.misses} fetched")
+        metrics.count("cacheHits", client.hits)
+        metrics.count("cacheMisses", client.misses)
+    
+    print("\nGarmin calls:")
+    print(metrics.summary())
+    write_metrics(metrics_path, metrics)
+    
+    if capabilities:
+        capabilities.save()
+    
+    # Persist tokens that were refreshed during the run
+    save_tokens(garmin, token_store)
     
     print("\n" + "=" * 50)
-    print(f"✓ Data saved to {output_path}")
+    print(f"✓ Data saved to {output_path}" if written else f"✓ Data unchanged in {output_path}")
     print("=" * 50)
+    return _summary(name, "ok", fetched, metrics)
+
+
+def export_database(data_dir: Path, isolated: bool = False) -> None:
+    """Regenerate data_dir/health_data.json from its HEALTH_DB without syncing."""
+    store_path = data_path("HEALTH_DB", data_dir, "health.db", isolated)
+    if not store_path or not store_path.exists():
+        raise SyncError(f"No database at {store_path}")
+    store = HealthStore(store_path)
+    output_path = data_dir / "health_data.json"
+    columnar_path = data_path("COLUMNAR_PATH", data_dir, "health_columns.json", isolated, enabled=False)
+    with AtomicBatch() as batch:
+        if columnar_path:
+            write_columnar(columnar_path, store.range(), env_flag("COLUMNAR_BINARY"), batch)
+        rollups_path = data_path("ROLLUPS_PATH", data_dir, "rollups.json", isolated, enabled=False)
+        if rollups_path:
+            update_rollups(rollups_path, store.range, batch=batch)
+        written = export_store(store, output_path, batch=batch, baselines=env_flag("BASELINES"))
+    if written:
+        print(f"✓ Exported {store.count()} days to {output_path}")
+    store.close()
+
+
+def _summary(name: str, status: str, days: int, metrics: Metrics) -> dict:
+    report = metrics.to_dict()
+    return {
+        "account": name,
+        "status": status,
+        "days": days,
+        "calls": sum(stats["calls"] for stats in report["endpoints"].values()),
+        "timingsSec": report["timingsSec"],
+    }
+
+
+def load_accounts(path: Path) -> list:
+    """Read the accounts config: a JSON list of {name, email[_env], password[_env], rps?, burst?}."""
+    accounts = []
+    seen = set()
+    for entry in json.loads(path.read_text(encoding="utf-8")):
+        name = entry.get("name", "")
+        if not re.fullmatch(r"[\w.-]+", name) or name in (".", "..", "cache", "checkpoints", "history"):
+            raise SyncError(f"Invalid account name {name!r} in {path}")
+        # Each account owns data_dir/<name>/, also on case-insensitive file systems
+        if name.casefold() in seen:
+            raise SyncError(f"Duplicate account name {name!r} in {path}")
+        seen.add(name.casefold())
+        accounts.append({
+            "name": name,
+            "email": entry.get("email") or os.environ.get(entry.get("email_env", "")),
+            "password": entry.get("password") or os.environ.get(entry.get("password_env", "")),
+            "rps": entry.get("rps"),
+            "burst": entry.get("burst"),
+        })
+    return accounts
+
+
+def sync_accounts(accounts: list, data_dir: Path) -> list:
+    """Sync several accounts concurrently, each into data_dir/<name>/."""
+    workers = env_int("ACCOUNT_WORKERS", 4)
+    requests_per_second = env_float("GARMIN_RPS", 3.0)
+    burst = env_int("GARMIN_BURST", 6)
+    token_store = os.environ.get("GARMIN_TOKEN_STORE", "~/.garminconnect")
+    # Optional budget shared by all accounts, e.g. for a single runner IP
+    global_rps = env_float("GARMIN_GLOBAL_RPS", 0)
+    shared_bucket = None
+    if global_rps > 0:
+        shared_bucket = TokenBucket(global_rps, env_int("GARMIN_GLOBAL_BURST", burst),
+                                    env_float("RATE_LIMIT_COOLDOWN", 10.0))
+    
+    def run(account: dict) -> dict:
+        started = time.perf_counter()
+        try:
+            if not os.environ.get("GARMIN_FAKE") and not (account["email"] and account["password"]):
+                raise SyncError("credentials missing")
+            summary = sync_account(
+                account["name"], account["email"], account["password"], data_dir / account["name"],
+                str(Path(token_store) / account["name"]) if token_store else "",
+                account["rps"] if account["rps"] is not None else requests_per_second,
+                account["burst"] if account["burst"] is not None else burst,
+                isolated=True, shared_bucket=shared_bucket,
+            )
+        except Exception as e:
+            print(f"✗ {account['name']}: {e}")
+            summary = {"account": account["name"], "status": "failed", "error": str(e)}
+        summary["wallTimeSec"] = round(time.perf_counter() - started, 3)
+        return summary
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(run, accounts))
+    
+    print("\nAccounts:")
+    for result in results:
+        print(f"  {result['account']:<20} {result['status']:<7} {result['wallTimeSec']:>8.1f}s  "
+              f"{result.get('days', 0):>5} days  {result.get('calls', 0):>6} calls")
+    
+    atomic_write_text(data_dir / "accounts_summary.json",
+                      json.dumps({"generatedAt": datetime.now().isoformat(), "accounts": results},
+                                 indent=2, ensure_ascii=False))
+    return results
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Sync Garmin Connect health data to JSON")
+    parser.add_argument("--export", action="store_true",
+                        help="regenerate health_data.json from HEALTH_DB without contacting Garmin")
+    args = parser.parse_args(argv)
+    
+    data_dir = Path(os.environ.get("DATA_DIR", "data"))
+    # JSON list of accounts to sync in one run (see README)
+    accounts_file = os.environ.get("ACCOUNTS_FILE")
+    
+    if args.export:
+        try:
+            if accounts_file:
+                for account in load_accounts(Path(accounts_file)):
+                    export_database(data_dir / account["name"], isolated=True)
+            else:
+                export_database(data_dir)
+        except (OSError, ValueError, SyncError, sqlite3.Error) as e:
+            print(f"✗ {e}")
+            exit(1)
+        return
+    
+    if Garmin is None and not os.environ.get("GARMIN_FAKE"):
+        print("ERROR: 'garminconnect' not installed!")
+        exit(1)
+    
+    # Get credentials from environment variables
+    email = os.environ.get("GARMIN_EMAIL")
+    password = os.environ.get("GARMIN_PASSWORD")
+    
+    if not accounts_file and not os.environ.get("GARMIN_FAKE") and (not email or not password):
+        print("ERROR: GARMIN_EMAIL and GARMIN_PASSWORD environment variables required")
+        exit(1)
+    
+    print("=" * 50)
+    print("HEWS Garmin Sync (GitHub Actions)")
+    print("=" * 50)
+    
+    if accounts_file:
+        try:
+            accounts = load_accounts(Path(accounts_file))
+        except (OSError, ValueError, SyncError) as e:
+            print(f"ERROR: cannot read {accounts_file}: {e}")
+            exit(1)
+        results = sync_accounts(accounts, data_dir)
+        # Keep the data of the accounts that worked; fail only if none did
+        if not any(result["status"] != "failed" for result in results):
+            exit(1)
+        return
+    
+    try:
+        sync_account("default", email, password, data_dir,
+                     os.environ.get("GARMIN_TOKEN_STORE", "~/.garminconnect"),
+                     env_float("GARMIN_RPS", 3.0), env_int("GARMIN_BURST", 6))
+    except SyncError as e:
+        print(f"✗ {e}")
+        exit(1)
 
 
 if __name__ == "__main__":
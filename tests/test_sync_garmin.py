@@ -0,0 +1,297 @@
+import json
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import sync_garmin
+from fake_garmin import FakeGarmin
+from sync_garmin import (CachedClient, CapabilityClient, Checkpoint, EndpointSkipped, MergedHistory, SyncError,
+                         content_hash, empty_record, get_date_string, load_accounts, merge_record, prefetch_ranges,
+                         save_output, stale_dates, stream_history, update_rollups)
+
+
+class StubGarmin:
+    def __init__(self, response):
+        self.response = response
+        self.calls = 0
+
+    def get_hrv_data(self, cdate):
+        self.calls += 1
+        return self.response
+
+
+def _write_entry(cache_dir, date_str, fetched_at, response):
+    path = cache_dir / "get_hrv_data" / f"{date_str}.json"
+    path.parent.mkdir(parents=True)
+    path.write_text(json.dumps({"fetchedAt": fetched_at.isoformat(), "response": response}), encoding="utf-8")
+    return path
+
+
+def test_provisional_cache_entry_is_refetched_once_day_is_old(tmp_path):
+    # Fetched while the day was still "today": HRV was not there yet
+    day = datetime.now() - timedelta(days=10)
+    path = _write_entry(tmp_path, get_date_string(day), day, None)
+    garmin = StubGarmin({"hrvSummary": {"lastNightAvg": 48}})
+    client = CachedClient(garmin, tmp_path, final_after_days=3)
+
+    assert client.get_hrv_data(get_date_string(day)) == {"hrvSummary": {"lastNightAvg": 48}}
+    assert garmin.calls == 1
+    # The fresh response is final now and served from the cache from here on
+    assert json.loads(path.read_text(encoding="utf-8"))["response"] == {"hrvSummary": {"lastNightAvg": 48}}
+    assert client.get_hrv_data(get_date_string(day)) == {"hrvSummary": {"lastNightAvg": 48}}
+    assert garmin.calls == 1
+
+
+def test_entry_fetched_after_final_horizon_is_served_from_cache(tmp_path):
+    day = datetime.now() - timedelta(days=10)
+    _write_entry(tmp_path, get_date_string(day), day + timedelta(days=4), {"hrvSummary": {"lastNightAvg": 51}})
+    garmin = StubGarmin({"hrvSummary": {"lastNightAvg": 99}})
+    client = CachedClient(garmin, tmp_path, final_after_days=3)
+
+    assert client.get_hrv_data(get_date_string(day)) == {"hrvSummary": {"lastNightAvg": 51}}
+    assert garmin.calls == 0
+    assert client.hits == 1
+
+
+def test_capability_skip_is_not_cached(tmp_path):
+    garmin = StubGarmin(None)
+    client = CachedClient(CapabilityClient(garmin, tmp_path / "capabilities.json", window=3, probe_every=7), tmp_path)
+    day = datetime(2025, 1, 1)
+    for offset in range(3):
+        client.get_hrv_data(get_date_string(day + timedelta(days=offset)))
+
+    skipped = get_date_string(day + timedelta(days=3))
+    with pytest.raises(EndpointSkipped):
+        client.get_hrv_data(skipped)
+    assert garmin.calls == 3
+    assert not (tmp_path / "get_hrv_data" / f"{skipped}.json").exists()
+
+
+def _record(date_str, **values):
+    return {**empty_record(date_str), **values}
+
+
+def test_merge_record_keeps_fields_of_failed_endpoints():
+    old = _record("2025-03-01", hrv=45, sleepScore=80, steps=9000)
+    new = _record("2025-03-01", steps=9100, failedEndpoints=["get_hrv_data"])
+
+    merged = merge_record(old, new)
+    assert merged["hrv"] == 45
+    assert merged["steps"] == 9100
+    # Fields of endpoints that answered are not back-filled
+    assert merged["sleepScore"] is None
+
+
+def test_stale_dates_picks_missing_provisional_and_failed_days():
+    today = datetime(2025, 3, 10)
+    complete = {"hrv": 45, "sleepScore": 80}
+    records = {
+        "2025-03-05": _record("2025-03-05", **complete),
+        "2025-03-06": _record("2025-03-06", hrv=45),
+        "2025-03-07": _record("2025-03-07", **complete, failedEndpoints=["get_stats"]),
+        "2025-03-08": _record("2025-03-08", **complete),
+        "2025-03-09": _record("2025-03-09", **complete),
+        "2025-03-10": _record("2025-03-10", **complete),
+    }
+
+    due = [get_date_string(day) for day in stale_dates(records, today, 7)]
+    assert due == ["2025-03-04", "2025-03-06", "2025-03-07", "2025-03-09", "2025-03-10"]
+
+
+def test_merged_history_keeps_days_outside_the_fetched_range():
+    previous = {day: _record(day, steps=1) for day in ("2025-01-01", "2025-01-02", "2025-01-05")}
+    fetched = [_record("2025-01-02", steps=2, failedEndpoints=["get_hrv_data"]), _record("2025-01-03", steps=3)]
+    previous["2025-01-02"]["hrv"] = 40
+
+    history = MergedHistory(previous, fetched, "2025-01-02", "2025-01-03")
+    assert [(r["date"], r["steps"]) for r in history] == [
+        ("2025-01-01", 1), ("2025-01-02", 2), ("2025-01-03", 3), ("2025-01-05", 1)]
+    assert len(history) == 4
+    assert history.get("2025-01-02")["hrv"] == 40
+    assert history.get("2025-01-05")["steps"] == 1
+
+
+def test_checkpoint_resumes_after_torn_last_line(tmp_path):
+    path = tmp_path / "historical.ndjson"
+    path.write_text(json.dumps(_record("2025-01-01", steps=1)) + "\n" + '{"date": "2025-01-02", "ste',
+                    encoding="utf-8")
+    checkpoint = Checkpoint(path)
+    assert list(checkpoint.load()) == ["2025-01-01"]
+
+    checkpoint.append(_record("2025-01-02", steps=2))
+    checkpoint.close()
+    assert {day: record["steps"] for day, record in checkpoint.load().items()} == {"2025-01-01": 1, "2025-01-02": 2}
+    assert [record["steps"] for record in checkpoint.records(checkpoint.index())] == [1, 2]
+
+
+def test_stream_resume_refetches_unsettled_days(tmp_path):
+    log = Checkpoint(tmp_path / "health_history.ndjson")
+    day = datetime(2025, 1, 1)
+    log.append({**_record("2025-01-01", hrv=40), "fetchedAt": (day + timedelta(days=5)).isoformat()})
+    # Fetched the same evening, so still provisional
+    log.append({**_record("2025-01-02", hrv=None), "fetchedAt": "2025-01-02T21:00:00"})
+    log.append({**_record("2025-01-03", hrv=41, failedEndpoints=["get_stats"]), "fetchedAt": "2025-01-09T06:00:00"})
+    log.close()
+    garmin = FakeGarmin()
+
+    offsets = stream_history(garmin, day, day + timedelta(days=3), log, final_after_days=3)
+    assert garmin.calls["get_stats"] == 3
+    records = {record["date"]: record for record in log.records(offsets)}
+    assert records["2025-01-01"]["hrv"] == 40
+    assert records["2025-01-02"]["hrv"] is not None
+    assert not records["2025-01-03"].get("failedEndpoints")
+
+
+def test_prefetch_skips_pages_the_cache_answers(tmp_path):
+    start = datetime(2025, 1, 1)
+    for offset in range(10):
+        day = start + timedelta(days=offset)
+        path = tmp_path / "get_body_composition" / f"{get_date_string(day)}.json"
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(json.dumps({"fetchedAt": (day + timedelta(days=5)).isoformat(), "response": None}),
+                        encoding="utf-8")
+    garmin = FakeGarmin()
+    client = CachedClient(garmin, tmp_path, final_after_days=3)
+
+    prefetched = prefetch_ranges(client, start, start + timedelta(days=29), 10, client.is_cached_final)
+    assert garmin.calls["get_body_composition"] == 2
+    assert min(prefetched["get_body_composition"]) == "2025-01-11"
+
+
+class WeeklyScale:
+    """A scale used on Mondays and a watch without an HRV sensor."""
+
+    def __init__(self):
+        self.hrv_calls = 0
+
+    def get_body_composition(self, startdate, enddate=None):
+        if datetime.strptime(startdate, "%Y-%m-%d").weekday() == 0:
+            return {"totalAverage": {"weight": 80000.0, "bmi": 24.0, "bodyFat": 18.0}}
+        return {"totalAverage": {}}
+
+    def get_hrv_data(self, cdate):
+        self.hrv_calls += 1
+        return None
+
+
+def test_capability_skips_keep_weekly_weigh_ins(tmp_path):
+    # 70 nightly runs of daily mode (yesterday + today), the profile persisted in between
+    garmin = WeeklyScale()
+    start = datetime(2026, 1, 1)
+    weighed = set()
+    for run in range(70):
+        client = CapabilityClient(garmin, tmp_path / "capabilities.json", window=14, probe_every=7)
+        today = start + timedelta(days=run)
+        for day in (get_date_string(today - timedelta(days=1)), get_date_string(today)):
+            if (client.get_body_composition(day) or {}).get("totalAverage", {}).get("weight"):
+                weighed.add(day)
+            try:
+                client.get_hrv_data(day)
+            except EndpointSkipped:
+                pass
+        client.save()
+
+    mondays = {get_date_string(start + timedelta(days=i)) for i in range(70) if (start + timedelta(days=i)).weekday() == 0}
+    assert len(mondays) == 10
+    assert weighed == mondays
+    # The endpoint that never has data is mostly skipped after the window
+    assert garmin.hrv_calls < 140 // 3
+
+
+@pytest.mark.parametrize("names", [["alice", "bob", "alice"], ["alice", "Alice"], ["history"], [".."]])
+def test_load_accounts_rejects_clashing_names(tmp_path, names):
+    path = tmp_path / "accounts.json"
+    path.write_text(json.dumps([{"name": name, "email": "a@b.c", "password": "x"} for name in names]),
+                    encoding="utf-8")
+    with pytest.raises(SyncError):
+        load_accounts(path)
+
+
+def test_save_output_skips_write_when_only_timestamps_change(tmp_path):
+    path = tmp_path / "health_data.json"
+    day = _record("2025-01-01", steps=9000)
+    output = {"lastSync": "2025-01-02T06:00:00", "mode": "daily", "today": day, "yesterday": None, "history": []}
+    assert save_output(path, output)
+    written = path.read_text(encoding="utf-8")
+
+    later = {**output, "lastSync": "2025-01-03T06:00:00", "today": {**day, "fetchedAt": "2025-01-03T06:00:00"}}
+    assert content_hash(later) == content_hash(output)
+    assert not save_output(path, later)
+    assert path.read_text(encoding="utf-8") == written
+
+    assert save_output(path, {**later, "today": {**day, "steps": 9100}})
+    assert json.loads(path.read_text(encoding="utf-8"))["today"]["steps"] == 9100
+
+
+def test_content_hash_ignores_the_mode():
+    output = {"lastSync": "2025-01-02T06:00:00", "mode": "daily", "today": _record("2025-01-01", steps=1),
+              "yesterday": None, "history": [_record("2025-01-01", steps=1)]}
+    assert content_hash({**output, "mode": "export"}) == content_hash(output)
+
+
+def _days(first, last, **values):
+    start = datetime.strptime(first, "%Y-%m-%d")
+    count = (datetime.strptime(last, "%Y-%m-%d") - start).days + 1
+    return [_record(get_date_string(start + timedelta(days=i)), **values) for i in range(count)]
+
+
+def test_rollups_of_a_later_range_keep_buckets_it_only_partly_covers(tmp_path):
+    path = tmp_path / "rollups.json"
+    update_rollups(path, _days("2025-01-01", "2025-06-30", steps=1000))
+    assert json.loads(path.read_text(encoding="utf-8"))["year"]["2025"]["days"] == 181
+
+    # A second import without a store only has its own range at hand
+    july = _days("2025-07-01", "2025-07-13", steps=2000)
+    update_rollups(path, july, [r["date"] for r in july], within=("2025-07-01", "2025-07-13"))
+    rollups = json.loads(path.read_text(encoding="utf-8"))
+    assert rollups["year"]["2025"]["days"] == 181
+    assert rollups["month"]["2025-06"]["stepsSum"] == 30000
+    assert "2025-07" not in rollups["month"]
+    assert rollups["week"]["2025-W27"]["days"] == 1
+    assert (rollups["week"]["2025-W28"]["days"], rollups["week"]["2025-W28"]["stepsSum"]) == (7, 14000)
+
+
+def test_incremental_rollups_match_a_full_rebuild(tmp_path):
+    history = _days("2024-12-20", "2025-02-10", steps=1000, sleepDuration=25000)
+    incremental, full = tmp_path / "incremental.json", tmp_path / "full.json"
+    update_rollups(incremental, history[:-10])
+
+    for i, record in enumerate(history[-12:]):
+        record["steps"] = 3000 + i
+    update_rollups(incremental, history, [r["date"] for r in history[-12:]])
+    update_rollups(full, history)
+
+    def periods(path):
+        return {k: v for k, v in json.loads(path.read_text(encoding="utf-8")).items() if k != "generatedAt"}
+    assert periods(incremental) == periods(full)
+
+
+def _mixed_history():
+    rng = random.Random(7)
+    history = _days("2024-11-20", "2025-03-05")
+    for i, record in enumerate(history):
+        record.update(steps=rng.randint(2000, 15000), floors=rng.choice([None, 3, 7.5]),
+                      intensityMinutes=None if i < 60 else rng.randint(0, 90),
+                      hrv=rng.choice([None, 41, 47.3]), rhr=rng.randint(48, 62), stressAvg=rng.randint(20, 45),
+                      sleepScore=rng.choice([None, 70, 85]), sleepDuration=rng.choice([None, 25200, 27990.5]),
+                      weight=rng.choice([None, 80.15]))
+    return history
+
+
+def test_numpy_rollups_and_binary_columns_match_pure_python(monkeypatch):
+    pytest.importorskip("numpy")
+    history = _mixed_history()
+    with_numpy = sync_garmin.compute_rollups(history)
+    binary_numpy = sync_garmin._columns_binary(sync_garmin.columnar(history))
+    monkeypatch.setattr(sync_garmin, "np", None)
+
+    # json.dumps tells 3 from 3.0, which == would not
+    assert json.dumps(sorted(with_numpy.items())) == json.dumps(sorted(sync_garmin.compute_rollups(history).items()))
+    assert binary_numpy == sync_garmin._columns_binary(sync_garmin.columnar(history))
+
+
+def test_stream_history_starts_a_new_log(tmp_path):
+    log = Checkpoint(tmp_path / "health_history.ndjson")
+    offsets = stream_history(FakeGarmin(), datetime(2025, 1, 1), datetime(2025, 1, 3), log)
+    assert list(offsets) == ["2025-01-01", "2025-01-02", "2025-01-03"]